@@ -1,21 +1,44 @@
-from flask import Flask, request, jsonify, send_file
+import time
+# Taken before any other import so the startup profile covers the whole module
+APP_IMPORT_STARTED = time.perf_counter()
+
+from flask import Flask, request, jsonify, send_file, Response, stream_with_context
 from flask_cors import CORS
 from functools import wraps
+from contextlib import contextmanager
 from dotenv import load_dotenv
 import jwt
 from jwt import PyJWKClient
 from jwt.exceptions import ExpiredSignatureError
 from PIL import Image
 import io
-import time
 import numpy as np
 import os
 import random
 import warnings
-from datetime import datetime
+from datetime import datetime, timedelta
 from werkzeug.utils import secure_filename
 import json
+import sqlite3
 import textwrap
+import importlib
+import importlib.util
+from importlib import metadata as importlib_metadata
+import threading
+import queue
+import uuid
+import math
+import hashlib
+import base64
+import re
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict, deque
+from statistics import NormalDist
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
 
 # Suppress specific transformers warnings
 warnings.filterwarnings('ignore', message='Could not find image processor class')
@@ -50,52 +73,208 @@ transforms = None
 plt = None
 sns = None
 PdfPages = None
+tf = None
+keras = None
 device = None
 
+# Heavy dependencies are imported per subsystem, only when an endpoint needs them
+DEPENDENCY_SUBSYSTEMS = {
+    'inference': ('torch', 'torchvision', 'transformers'),
+    'plotting': ('matplotlib', 'seaborn'),
+    'keras': ('tensorflow',)
+}
+# PRELOAD_DEPENDENCIES=inference,plotting imports those subsystems at startup instead
+PRELOAD_DEPENDENCIES = [name.strip() for name in os.getenv("PRELOAD_DEPENDENCIES", "").split(",") if name.strip()]
+IMPORT_PROFILE = {}
+_dependency_locks = {name: threading.Lock() for name in DEPENDENCY_SUBSYSTEMS}
+
 
-def ensure_ml_dependencies():
-    """Import heavy ML and plotting dependencies only when they are needed."""
-    global torch, nn, F, AutoImageProcessor, AutoModelForImageClassification
-    global transforms, plt, sns, PdfPages, device
+def _import_timed(timings, module_name):
+    started = time.perf_counter()
+    module = importlib.import_module(module_name)
+    timings[module_name] = time.perf_counter() - started
+    return module
 
-    if torch is not None:
+def _record_import_profile(subsystem, timings):
+    total = sum(timings.values())
+    IMPORT_PROFILE[subsystem] = {
+        'seconds': round(total, 3),
+        'modules': {name: round(seconds, 3) for name, seconds in timings.items()}
+    }
+    slowest = ', '.join(f"{name} {seconds:.2f}s" for name, seconds in sorted(timings.items(), key=lambda item: -item[1])[:3])
+    print(f"📦 Loaded {subsystem} dependencies in {total:.2f}s ({slowest})")
+
+def ensure_inference_dependencies():
+    """Import torch, torchvision and transformers only when a model is loaded or attacked."""
+    if device is not None:
         return
 
-    import matplotlib
-    matplotlib.use('Agg')
+    # Concurrent first requests must not import the stack (or see it half-assigned) twice
+    with _dependency_locks['inference']:
+        if device is None:
+            _import_inference_dependencies()
 
-    import torch as _torch
-    import torch.nn as _nn
-    import torch.nn.functional as _F
-    from transformers import AutoImageProcessor as _AutoImageProcessor, AutoModelForImageClassification as _AutoModelForImageClassification
-    from torchvision import transforms as _transforms
-    import matplotlib.pyplot as _plt
-    import seaborn as _sns
-    from matplotlib.backends.backend_pdf import PdfPages as _PdfPages
+def _import_inference_dependencies():
+    global torch, nn, F, AutoImageProcessor, AutoModelForImageClassification, transforms, device
+
+    timings = {}
+    _torch = _import_timed(timings, 'torch')
+    _nn = _import_timed(timings, 'torch.nn')
+    _F = _import_timed(timings, 'torch.nn.functional')
+    _transformers = _import_timed(timings, 'transformers')
+    _transforms = _import_timed(timings, 'torchvision.transforms')
 
     torch = _torch
     nn = _nn
     F = _F
-    AutoImageProcessor = _AutoImageProcessor
-    AutoModelForImageClassification = _AutoModelForImageClassification
+    AutoImageProcessor = _transformers.AutoImageProcessor
+    AutoModelForImageClassification = _transformers.AutoModelForImageClassification
     transforms = _transforms
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    _record_import_profile('inference', timings)
+
+def ensure_plotting_dependencies():
+    """Import matplotlib and seaborn only when a report is generated."""
+    if PdfPages is not None:
+        return
+
+    with _dependency_locks['plotting']:
+        if PdfPages is None:
+            _import_plotting_dependencies()
+
+def _import_plotting_dependencies():
+    global plt, sns, PdfPages
+
+    timings = {}
+    matplotlib = _import_timed(timings, 'matplotlib')
+    matplotlib.use('Agg')
+    _plt = _import_timed(timings, 'matplotlib.pyplot')
+    _sns = _import_timed(timings, 'seaborn')
+    _backend_pdf = _import_timed(timings, 'matplotlib.backends.backend_pdf')
+
     plt = _plt
     sns = _sns
-    PdfPages = _PdfPages
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    PdfPages = _backend_pdf.PdfPages
+    _record_import_profile('plotting', timings)
+
+def ensure_keras_dependencies():
+    """Import TensorFlow only when a Keras model is loaded. Raises ImportError if it is not installed."""
+    if keras is not None:
+        return
+
+    with _dependency_locks['keras']:
+        if keras is None:
+            _import_keras_dependencies()
+
+def _import_keras_dependencies():
+    global tf, keras
+
+    timings = {}
+    _tf = _import_timed(timings, 'tensorflow')
+
+    tf = _tf
+    keras = _tf.keras
+    _record_import_profile('keras', timings)
+
+DEPENDENCY_LOADERS = {
+    'inference': ensure_inference_dependencies,
+    'plotting': ensure_plotting_dependencies,
+    'keras': ensure_keras_dependencies
+}
+
+def dependency_status():
+    """Report which subsystems are imported and installed, without importing anything."""
+    loaded = {'inference': device is not None, 'plotting': PdfPages is not None, 'keras': keras is not None}
+    status = {}
+    for subsystem, packages in DEPENDENCY_SUBSYSTEMS.items():
+        status[subsystem] = {
+            'loaded': loaded[subsystem],
+            'installed': all(importlib.util.find_spec(package) is not None for package in packages),
+            'import_seconds': IMPORT_PROFILE.get(subsystem, {}).get('seconds')
+        }
+    return status
 
 # Clerk JWT verification settings
 CLERK_JWKS_URL = os.getenv("CLERK_JWKS_URL")
 CLERK_ISSUER = os.getenv("CLERK_ISSUER")
 CLERK_AUDIENCE = os.getenv("CLERK_AUDIENCE")
 CLERK_JWT_LEEWAY_SECONDS = int(os.getenv("CLERK_JWT_LEEWAY_SECONDS", "120"))
-CLERK_JWKS_CLIENT = PyJWKClient(CLERK_JWKS_URL) if CLERK_JWKS_URL else None
+# Local JWKS document used instead of CLERK_JWKS_URL (offline and test deployments)
+CLERK_JWKS_FILE = os.getenv("CLERK_JWKS_FILE")
+# JWKS keys older than this are refreshed in the background while still being served
+CLERK_JWKS_REFRESH_SECONDS = int(os.getenv("CLERK_JWKS_REFRESH_SECONDS", "600"))
+# Minimum gap between synchronous refetches triggered by an unknown key id
+CLERK_JWKS_MIN_REFETCH_SECONDS = int(os.getenv("CLERK_JWKS_MIN_REFETCH_SECONDS", "30"))
+# Verified session tokens are reused until this many seconds before they expire
+CLERK_TOKEN_CACHE_SIZE = int(os.getenv("CLERK_TOKEN_CACHE_SIZE", "1024"))
+CLERK_TOKEN_CACHE_MARGIN_SECONDS = int(os.getenv("CLERK_TOKEN_CACHE_MARGIN_SECONDS", "30"))
 
 # Directories
 ATTACK_IMAGES_FOLDER = os.path.join(os.path.dirname(__file__), 'attack')
 MODELS_FOLDER = os.path.join(os.path.dirname(__file__), 'models')
 MODELS_METADATA_FILE = os.path.join(MODELS_FOLDER, 'models_metadata.json')
 HISTORY_RECORDS_FILE = os.path.join(MODELS_FOLDER, 'history_records.json')
+HISTORY_DB_FILE = os.path.join(MODELS_FOLDER, 'history.db')
+# Days of assessment history to keep (0 keeps everything)
+HISTORY_RETENTION_DAYS = int(os.getenv("HISTORY_RETENTION_DAYS", "365"))
+
+# In-process model cache budget (loaded weights kept between assessments)
+MODEL_CACHE_MAX_MB = int(os.getenv("MODEL_CACHE_MAX_MB", "4096"))
+
+# Admission control: estimated memory of running assessments and uploads must fit this budget
+ASSESSMENT_MEMORY_BUDGET_MB = int(os.getenv("ASSESSMENT_MEMORY_BUDGET_MB", "8192"))
+ADMISSION_MAX_QUEUED = int(os.getenv("ADMISSION_MAX_QUEUED", "16"))
+ADMISSION_QUEUE_TIMEOUT_SECONDS = float(os.getenv("ADMISSION_QUEUE_TIMEOUT_SECONDS", "30"))
+ADMISSION_RETRY_AFTER_SECONDS = int(os.getenv("ADMISSION_RETRY_AFTER_SECONDS", "10"))
+# Weight size assumed for Hugging Face models that are not downloaded yet
+ADMISSION_DEFAULT_MODEL_MB = int(os.getenv("ADMISSION_DEFAULT_MODEL_MB", "1024"))
+# Activation (forward + input-gradient) memory per image, as a multiple of the input tensor size
+ADMISSION_ACTIVATION_FACTOR = int(os.getenv("ADMISSION_ACTIVATION_FACTOR", "150"))
+
+# Number of images stacked into one attack forward/backward pass
+ATTACK_BATCH_SIZE = int(os.getenv("ATTACK_BATCH_SIZE", "16"))
+# Upper bound on a requested batch_size so one request cannot stack the whole attack folder
+MAX_ATTACK_BATCH_SIZE = int(os.getenv("MAX_ATTACK_BATCH_SIZE", "64"))
+
+# Attack images sampled per assessment when the request does not say
+DEFAULT_NUM_IMAGES = int(os.getenv("DEFAULT_NUM_IMAGES", "10"))
+# Sampling seed used when a request sends none, so repeated requests hit the result cache
+DEFAULT_SAMPLE_SEED = int(os.getenv("DEFAULT_SAMPLE_SEED", "0"))
+
+# Decoded/resized attack images, cached per processor configuration
+IMAGE_CACHE_FOLDER = os.path.join(MODELS_FOLDER, 'image_cache')
+
+# Parallel image decoding and batch prefetching
+IMAGE_DECODE_WORKERS = int(os.getenv("IMAGE_DECODE_WORKERS", "4"))
+IMAGE_PREFETCH_WORKERS = int(os.getenv("IMAGE_PREFETCH_WORKERS", "2"))
+IMAGE_PREFETCH_BATCHES = int(os.getenv("IMAGE_PREFETCH_BATCHES", "2"))
+
+# On-disk cache of completed assessment results
+RESULT_CACHE_FOLDER = os.path.join(MODELS_FOLDER, 'result_cache')
+RESULT_CACHE_MAX_MB = int(os.getenv("RESULT_CACHE_MAX_MB", "256"))
+RESULT_CACHE_VERSION = 1
+
+# Epsilon sweeps (robustness curves)
+SWEEP_ATTACKS = ('fgsm', 'pgd')
+SWEEP_MAX_EPSILONS = int(os.getenv("SWEEP_MAX_EPSILONS", "20"))
+PGD_SWEEP_WARM_ITERATIONS = int(os.getenv("PGD_SWEEP_WARM_ITERATIONS", "5"))
+
+# Streaming responses send a heartbeat this often, which also detects disconnected clients
+SSE_HEARTBEAT_SECONDS = float(os.getenv("SSE_HEARTBEAT_SECONDS", "2"))
+
+# Multi-model comparisons
+COMPARISON_MAX_MODELS = int(os.getenv("COMPARISON_MAX_MODELS", "8"))
+
+# Background assessment jobs
+JOBS_FOLDER = os.path.join(MODELS_FOLDER, 'jobs')
+ASSESSMENT_JOB_WORKERS = int(os.getenv("ASSESSMENT_JOB_WORKERS", "2"))
+ASSESSMENT_JOB_MAX_PENDING = int(os.getenv("ASSESSMENT_JOB_MAX_PENDING", "20"))
+# Finished jobs kept in memory and in JOBS_FOLDER
+ASSESSMENT_JOB_RETENTION = int(os.getenv("ASSESSMENT_JOB_RETENTION", "200"))
+# Running jobs write their progress to disk at most this often
+ASSESSMENT_JOB_PERSIST_SECONDS = float(os.getenv("ASSESSMENT_JOB_PERSIST_SECONDS", "1"))
+# How often a running job checks for a cancel request made through another worker
+ASSESSMENT_JOB_CANCEL_POLL_SECONDS = float(os.getenv("ASSESSMENT_JOB_CANCEL_POLL_SECONDS", "1"))
 
 # Ensure directories exist
 os.makedirs(MODELS_FOLDER, exist_ok=True)
@@ -110,17 +289,201 @@ def allowed_file(filename):
     """Check if file has allowed extension"""
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+class ClerkKeySet:
+    """
+    Clerk's JWKS signing keys, indexed by key id.
+    
+    Keys are loaded once at startup from CLERK_JWKS_FILE or CLERK_JWKS_URL. Once they
+    are older than refresh_seconds they keep being served while a background thread
+    fetches the new set (stale-while-revalidate), so token verification never waits on
+    the network. Only a key id that is not in the set forces a synchronous refetch, at
+    most once every min_refetch_seconds.
+    """
+
+    def __init__(self, url, path, refresh_seconds, min_refetch_seconds):
+        self.url = url
+        self.path = path
+        self.refresh_seconds = refresh_seconds
+        self.min_refetch_seconds = min_refetch_seconds
+        self._lock = threading.Lock()
+        self._fetch_lock = threading.Lock()
+        self._keys = {}
+        self._loaded_at = None
+        self._last_attempt = 0.0
+        self._refreshing = False
+        self.fetches = 0
+        self.fetch_errors = 0
+        self.background_refreshes = 0
+
+    @property
+    def configured(self):
+        return bool(self.url or self.path)
+
+    def _fetch(self):
+        if self.path:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+        else:
+            data = PyJWKClient(self.url, cache_jwk_set=False).fetch_data()
+        return {key.key_id: key.key for key in jwt.PyJWKSet.from_dict(data).keys}
+
+    def refresh(self):
+        """Fetch the key set now. Returns False (keeping the current keys) on failure."""
+        with self._fetch_lock:
+            return self._refresh_locked()
+
+    def _refresh_locked(self):
+        # Caller holds self._fetch_lock
+        self._last_attempt = time.time()
+        try:
+            keys = self._fetch()
+        except Exception as e:
+            self.fetch_errors += 1
+            print(f"⚠️  Could not load Clerk JWKS: {str(e)}")
+            return False
+        with self._lock:
+            self._keys = keys
+            self._loaded_at = time.time()
+            self.fetches += 1
+        return True
+
+    def _refresh_in_background(self):
+        try:
+            self.refresh()
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def prefetch(self):
+        """Load the key set at startup without blocking the import on the network."""
+        if not self.configured:
+            return
+        if self.path:
+            self.refresh()
+            return
+        with self._lock:
+            self._refreshing = True
+        threading.Thread(target=self._refresh_in_background, name='clerk-jwks', daemon=True).start()
+
+    def get_signing_key(self, key_id):
+        if not self.configured:
+            raise Exception("CLERK_JWKS_URL or CLERK_JWKS_FILE is not configured")
+
+        with self._lock:
+            signing_key = self._keys.get(key_id)
+            stale = self._loaded_at is not None and time.time() - self._loaded_at > self.refresh_seconds
+            if signing_key is not None and stale and not self._refreshing:
+                self._refreshing = True
+                self.background_refreshes += 1
+                threading.Thread(target=self._refresh_in_background, name='clerk-jwks', daemon=True).start()
+        if signing_key is not None:
+            return signing_key
+
+        # Unknown key id: the keys were rotated or have not been loaded yet
+        with self._fetch_lock:
+            with self._lock:
+                signing_key = self._keys.get(key_id)
+            if signing_key is None and time.time() - self._last_attempt >= self.min_refetch_seconds:
+                self._refresh_locked()
+                with self._lock:
+                    signing_key = self._keys.get(key_id)
+        if signing_key is None:
+            raise Exception(f"No Clerk signing key found for key id {key_id!r}")
+        return signing_key
+
+    def stats(self):
+        with self._lock:
+            return {
+                'source': 'file' if self.path else 'url' if self.url else None,
+                'keys': len(self._keys),
+                'age_seconds': round(time.time() - self._loaded_at, 1) if self._loaded_at else None,
+                'fetches': self.fetches,
+                'fetch_errors': self.fetch_errors,
+                'background_refreshes': self.background_refreshes
+            }
+
+class VerifiedTokenCache:
+    """
+    Bounded LRU of verified Clerk session token claims, keyed by the token's SHA-256.
+    
+    Entries expire margin_seconds before the token's exp, so a cached token is never
+    accepted past its expiry. Tokens without an exp claim are not cached.
+    """
+
+    def __init__(self, max_entries, margin_seconds):
+        self.max_entries = max_entries
+        self.margin_seconds = margin_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.verifications = 0
+        self.verification_seconds = 0.0
+        self.max_verification_seconds = 0.0
+
+    @staticmethod
+    def _key(token):
+        return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+    def get(self, token):
+        key = self._key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > time.time():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return dict(entry[0])
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, token, claims, verification_seconds):
+        with self._lock:
+            self.verifications += 1
+            self.verification_seconds += verification_seconds
+            self.max_verification_seconds = max(self.max_verification_seconds, verification_seconds)
+            exp = claims.get('exp')
+            if self.max_entries <= 0 or not isinstance(exp, (int, float)):
+                return
+            expires_at = exp - self.margin_seconds
+            if expires_at <= time.time():
+                return
+            key = self._key(token)
+            self._entries[key] = (dict(claims), expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'verifications': self.verifications,
+                'avg_verification_ms': round(self.verification_seconds / self.verifications * 1000, 3) if self.verifications else None,
+                'max_verification_ms': round(self.max_verification_seconds * 1000, 3)
+            }
+
+CLERK_KEY_SET = ClerkKeySet(CLERK_JWKS_URL, CLERK_JWKS_FILE, CLERK_JWKS_REFRESH_SECONDS, CLERK_JWKS_MIN_REFETCH_SECONDS)
+CLERK_KEY_SET.prefetch()
+VERIFIED_TOKENS = VerifiedTokenCache(CLERK_TOKEN_CACHE_SIZE, CLERK_TOKEN_CACHE_MARGIN_SECONDS)
+
 def verify_clerk_jwt(token):
-    if not CLERK_JWKS_CLIENT:
-        raise Exception("CLERK_JWKS_URL is not configured")
+    claims = VERIFIED_TOKENS.get(token)
+    if claims is not None:
+        return claims
 
-    signing_key = CLERK_JWKS_CLIENT.get_signing_key_from_jwt(token).key
+    started = time.perf_counter()
+    signing_key = CLERK_KEY_SET.get_signing_key(jwt.get_unverified_header(token).get('kid'))
     options = {
         "verify_aud": bool(CLERK_AUDIENCE),
         "verify_iss": bool(CLERK_ISSUER)
     }
 
-    return jwt.decode(
+    claims = jwt.decode(
         token,
         signing_key,
         algorithms=["RS256"],
@@ -129,6 +492,8 @@ def verify_clerk_jwt(token):
         options=options,
         leeway=CLERK_JWT_LEEWAY_SECONDS
     )
+    VERIFIED_TOKENS.put(token, claims, time.perf_counter() - started)
+    return claims
 
 def require_clerk_auth(handler):
     @wraps(handler)
@@ -156,36 +521,348 @@ def require_clerk_auth(handler):
 
     return wrapper
 
-def load_models_metadata():
-    """Load models metadata from JSON file"""
-    if os.path.exists(MODELS_METADATA_FILE):
+@contextmanager
+def exclusive_file_lock(lock_path):
+    """Hold an exclusive lock on lock_path, shared with other processes (e.g. gunicorn workers)."""
+    os.makedirs(os.path.dirname(lock_path) or '.', exist_ok=True)
+    with open(lock_path, 'a+') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        else:
+            lock_file.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    # LK_LOCK gives up after ~10 seconds; keep waiting
+                    continue
         try:
-            with open(MODELS_METADATA_FILE, 'r') as f:
-                return json.load(f)
-        except:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+class ModelRegistry:
+    """
+    Custom model metadata backed by models_metadata.json.
+    
+    Reads are served from an in-memory dict that is reloaded only when the file's
+    mtime or size changes, so lookups by model id are O(1). Updates take an
+    inter-process lock on a sidecar .lock file, re-read the current file and
+    replace it atomically, so several workers can upload and delete models
+    without losing each other's changes or exposing a half-written file.
+    """
+    
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._metadata = {}
+        self._signature = None
+    
+    def _file_signature(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+    
+    def _read(self):
+        try:
+            with open(self.path, 'r') as f:
+                metadata = json.load(f)
+            return metadata if isinstance(metadata, dict) else {}
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            print(f"⚠️  Could not read model metadata: {str(e)}")
             return {}
-    return {}
+    
+    def _refresh(self):
+        signature = self._file_signature()
+        if signature != self._signature:
+            with self._lock:
+                signature = self._file_signature()
+                if signature != self._signature:
+                    self._metadata = self._read()
+                    self._signature = signature
+        return self._metadata
+    
+    def _file_lock(self):
+        """Hold an exclusive lock shared with other processes serving this folder."""
+        return exclusive_file_lock(self.path + '.lock')
+    
+    def _write(self, metadata):
+        temp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp_path, 'w') as f:
+                json.dump(metadata, f, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, self.path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+    
+    def _update(self, mutate):
+        """Apply mutate(metadata) to the latest on-disk metadata and persist it atomically."""
+        with self._lock, self._file_lock():
+            metadata = self._read()
+            result = mutate(metadata)
+            self._write(metadata)
+            self._metadata = metadata
+            self._signature = self._file_signature()
+            return result
+    
+    def get(self, model_id):
+        """Return a copy of one model's metadata, or None if it is not registered."""
+        info = self._refresh().get(model_id)
+        return dict(info) if info is not None else None
+    
+    def all(self):
+        """Return a snapshot of every registered model's metadata."""
+        return {model_id: dict(info) for model_id, info in self._refresh().items()}
+    
+    def put(self, model_id, info):
+        def mutate(metadata):
+            metadata[model_id] = info
+        self._update(mutate)
+        return dict(info)
+    
+    def remove(self, model_id):
+        """Unregister a model and return its metadata, or None if it was not registered."""
+        return self._update(lambda metadata: metadata.pop(model_id, None))
+
+MODEL_REGISTRY = ModelRegistry(MODELS_METADATA_FILE)
+
+HISTORY_COLUMNS = ('id', 'user_id', 'timestamp', 'model_id', 'attack_type', 'success_rate',
+                   'original_accuracy', 'adversarial_accuracy', 'num_images', 'severity', 'type')
+
+class HistoryStore:
+    """
+    Threat assessment history in SQLite (WAL mode, one connection per thread). Records are
+    indexed by (user_id, timestamp) and model_id. Records older than the retention window
+    are pruned. Daily per-model/attack rollups are kept up to date on insert, so trend
+    queries never scan the records. The legacy history_records.json is imported once on
+    first use.
+    """
+
+    def __init__(self, db_path, legacy_json_path, retention_days=0):
+        self.db_path = db_path
+        self.legacy_json_path = legacy_json_path
+        self.retention_days = retention_days
+        self._local = threading.local()
+        self._init_lock = threading.Lock()
+        self._initialized = False
+        self._last_prune = 0.0
+
+    def _connect(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+            connection = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            connection.row_factory = sqlite3.Row
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+        
+        if not self._initialized:
+            with self._init_lock:
+                if not self._initialized:
+                    self._initialize(connection)
+                    self._initialized = True
+        return connection
 
-def save_models_metadata(metadata):
-    """Save models metadata to JSON file"""
-    with open(MODELS_METADATA_FILE, 'w') as f:
-        json.dump(metadata, f, indent=2)
+    def _initialize(self, connection):
+        connection.executescript("""
+            CREATE TABLE IF NOT EXISTS history_records (
+                id TEXT PRIMARY KEY,
+                user_id TEXT NOT NULL,
+                timestamp TEXT NOT NULL,
+                model_id TEXT,
+                attack_type TEXT,
+                success_rate REAL,
+                original_accuracy REAL,
+                adversarial_accuracy REAL,
+                num_images INTEGER,
+                severity TEXT,
+                type TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_history_user_timestamp ON history_records (user_id, timestamp);
+            CREATE INDEX IF NOT EXISTS idx_history_model ON history_records (model_id);
+            CREATE INDEX IF NOT EXISTS idx_history_timestamp ON history_records (timestamp);
+            CREATE TABLE IF NOT EXISTS history_daily_rollups (
+                user_id TEXT NOT NULL,
+                day TEXT NOT NULL,
+                model_id TEXT NOT NULL,
+                attack_type TEXT NOT NULL,
+                count INTEGER NOT NULL,
+                success_rate_sum REAL NOT NULL,
+                original_accuracy_sum REAL NOT NULL,
+                adversarial_accuracy_sum REAL NOT NULL,
+                PRIMARY KEY (user_id, day, model_id, attack_type)
+            );
+            CREATE TABLE IF NOT EXISTS history_meta (key TEXT PRIMARY KEY, value TEXT);
+        """)
+        self._migrate_legacy_json(connection)
+        self._build_rollups(connection)
 
-def load_history_records():
-    """Load threat assessment history records from JSON file."""
-    if os.path.exists(HISTORY_RECORDS_FILE):
+    def _build_rollups(self, connection):
+        """Backfill the daily rollups from existing records, once."""
+        connection.execute('BEGIN IMMEDIATE')
         try:
-            with open(HISTORY_RECORDS_FILE, 'r') as f:
-                data = json.load(f)
-            return data if isinstance(data, list) else []
+            if connection.execute("SELECT value FROM history_meta WHERE key = 'rollups_built'").fetchone() is None:
+                connection.execute("DELETE FROM history_daily_rollups")
+                connection.execute("""
+                    INSERT INTO history_daily_rollups
+                    SELECT user_id, substr(timestamp, 1, 10), COALESCE(model_id, ''), COALESCE(attack_type, ''), COUNT(*),
+                           SUM(success_rate), SUM(original_accuracy), SUM(adversarial_accuracy)
+                    FROM history_records
+                    GROUP BY user_id, substr(timestamp, 1, 10), COALESCE(model_id, ''), COALESCE(attack_type, '')
+                """)
+                connection.execute("INSERT INTO history_meta (key, value) VALUES ('rollups_built', ?)",
+                                   (datetime.utcnow().isoformat() + 'Z',))
+            connection.execute('COMMIT')
         except Exception:
-            return []
-    return []
+            connection.execute('ROLLBACK')
+            raise
 
-def save_history_records(records):
-    """Save threat assessment history records to JSON file."""
-    with open(HISTORY_RECORDS_FILE, 'w') as f:
-        json.dump(records, f, indent=2)
+    def _migrate_legacy_json(self, connection):
+        """One-shot import of history_records.json; the file is renamed once imported."""
+        if not os.path.exists(self.legacy_json_path):
+            return
+        
+        # IMMEDIATE takes the write lock, so only one worker process imports the file
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            migrated = connection.execute("SELECT value FROM history_meta WHERE key = 'json_migrated'").fetchone()
+            if migrated is None and os.path.exists(self.legacy_json_path):
+                with open(self.legacy_json_path, 'r') as f:
+                    records = json.load(f)
+                records = [record for record in (records if isinstance(records, list) else [])
+                           if isinstance(record, dict) and record.get('id') and record.get('user_id')]
+                connection.executemany(
+                    f"INSERT OR IGNORE INTO history_records ({', '.join(HISTORY_COLUMNS)}) "
+                    f"VALUES ({', '.join('?' for _ in HISTORY_COLUMNS)})",
+                    [tuple(record.get(column) for column in HISTORY_COLUMNS) for record in records]
+                )
+                connection.execute("INSERT INTO history_meta (key, value) VALUES ('json_migrated', ?)",
+                                   (datetime.utcnow().isoformat() + 'Z',))
+                print(f"📦 Migrated {len(records)} history records from {os.path.basename(self.legacy_json_path)}")
+            connection.execute('COMMIT')
+        except Exception as e:
+            connection.execute('ROLLBACK')
+            print(f"⚠️ Could not migrate history records: {e}")
+            return
+        
+        try:
+            os.replace(self.legacy_json_path, self.legacy_json_path + '.migrated')
+        except OSError:
+            pass
+
+    def insert(self, record):
+        connection = self._connect()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            inserted = connection.execute(
+                f"INSERT OR IGNORE INTO history_records ({', '.join(HISTORY_COLUMNS)}) "
+                f"VALUES ({', '.join('?' for _ in HISTORY_COLUMNS)})",
+                tuple(record.get(column) for column in HISTORY_COLUMNS)
+            ).rowcount
+            if inserted:
+                connection.execute("""
+                    INSERT INTO history_daily_rollups VALUES (?, ?, ?, ?, 1, ?, ?, ?)
+                    ON CONFLICT (user_id, day, model_id, attack_type) DO UPDATE SET
+                        count = count + 1,
+                        success_rate_sum = success_rate_sum + excluded.success_rate_sum,
+                        original_accuracy_sum = original_accuracy_sum + excluded.original_accuracy_sum,
+                        adversarial_accuracy_sum = adversarial_accuracy_sum + excluded.adversarial_accuracy_sum
+                """, (record['user_id'], record['timestamp'][:10], record.get('model_id') or '', record.get('attack_type') or '',
+                      record.get('success_rate') or 0, record.get('original_accuracy') or 0, record.get('adversarial_accuracy') or 0))
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        self._prune_if_due(connection)
+
+    def recent(self, user_id, limit):
+        return self.query(user_id, limit=limit)[0]
+
+    @staticmethod
+    def _filter_clauses(filters, time_column):
+        clauses, values = [], []
+        for key in ('model_id', 'attack_type', 'severity'):
+            if filters.get(key):
+                clauses.append(f"{key} = ?")
+                values.append(filters[key])
+        if filters.get('from'):
+            clauses.append(f"{time_column} >= ?")
+            values.append(filters['from'])
+        if filters.get('to'):
+            clauses.append(f"{time_column} < ?")
+            values.append(filters['to'])
+        return clauses, values
+
+    def query(self, user_id, filters=None, limit=20, cursor=None):
+        """
+        One page of a user's records, newest first. Pages are keyed on (timestamp, id), so
+        the cursor seeks through the (user_id, timestamp) index. Returns (records, next_cursor).
+        """
+        clauses, values = self._filter_clauses(filters or {}, 'timestamp')
+        if cursor is not None:
+            clauses.append("(timestamp < ? OR (timestamp = ? AND id < ?))")
+            values.extend([cursor[0], cursor[0], cursor[1]])
+        where = ' AND '.join(['user_id = ?'] + clauses)
+        rows = self._connect().execute(
+            f"SELECT * FROM history_records WHERE {where} ORDER BY timestamp DESC, id DESC LIMIT ?",
+            [user_id] + values + [limit + 1]
+        ).fetchall()
+        
+        records = [dict(row) for row in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit:
+            next_cursor = (records[-1]['timestamp'], records[-1]['id'])
+        return records, next_cursor
+
+    def daily_aggregates(self, user_id, filters=None):
+        """Mean metrics per day, model and attack type, read from the rollups."""
+        filters = dict(filters or {})
+        filters.pop('severity', None)
+        clauses, values = self._filter_clauses(filters, 'day')
+        where = ' AND '.join(['user_id = ?'] + clauses)
+        rows = self._connect().execute(
+            f"SELECT day, model_id, attack_type, count, success_rate_sum, original_accuracy_sum, adversarial_accuracy_sum "
+            f"FROM history_daily_rollups WHERE {where} ORDER BY day, model_id, attack_type",
+            [user_id] + values
+        ).fetchall()
+        return [{
+            'day': row['day'],
+            'model_id': row['model_id'],
+            'attack_type': row['attack_type'],
+            'count': row['count'],
+            'mean_success_rate': row['success_rate_sum'] / row['count'],
+            'mean_original_accuracy': row['original_accuracy_sum'] / row['count'],
+            'mean_adversarial_accuracy': row['adversarial_accuracy_sum'] / row['count']
+        } for row in rows]
+
+    def _prune_if_due(self, connection, interval_seconds=3600):
+        """Drop records past the retention window, at most once per interval."""
+        if not self.retention_days or time.time() - self._last_prune < interval_seconds:
+            return
+        self._last_prune = time.time()
+        cutoff = datetime.utcfromtimestamp(time.time() - self.retention_days * 86400).isoformat() + 'Z'
+        deleted = connection.execute("DELETE FROM history_records WHERE timestamp < ?", (cutoff,)).rowcount
+        if deleted:
+            print(f"🗑️  Pruned {deleted} history records older than {self.retention_days} days")
+
+HISTORY_STORE = HistoryStore(HISTORY_DB_FILE, HISTORY_RECORDS_FILE, HISTORY_RETENTION_DAYS)
+
+def severity_for_success_rate(success_rate):
+    """Map an attack success rate (percent) to the low/medium/high severity bucket."""
+    return 'high' if success_rate >= 70 else 'medium' if success_rate >= 40 else 'low'
 
 def persist_history_record(clerk_claims, model_id, attack_type, response_data):
     """Persist one history record per completed threat assessment."""
@@ -193,13 +870,12 @@ def persist_history_record(clerk_claims, model_id, attack_type, response_data):
     if not user_id:
         return
 
-    records = load_history_records()
     timestamp = datetime.utcnow().isoformat() + 'Z'
     success_rate = float(response_data.get('success_rate', 0))
-    severity = 'high' if success_rate >= 70 else 'medium' if success_rate >= 40 else 'low'
+    severity = severity_for_success_rate(success_rate)
 
-    records.append({
-        'id': f"{int(time.time() * 1000)}-{random.randint(1000, 9999)}",
+    HISTORY_STORE.insert({
+        'id': uuid.uuid4().hex,
         'user_id': user_id,
         'timestamp': timestamp,
         'model_id': model_id,
@@ -212,13 +888,18 @@ def persist_history_record(clerk_claims, model_id, attack_type, response_data):
         'type': 'Threat Assessment Completed'
     })
 
-    # Keep most recent records only to avoid unbounded growth.
-    records = records[-500:]
-    save_history_records(records)
+def persist_assessment_history(clerk_claims, model_id, response_data):
+    """Persist one history record for each attack in an assessment response."""
+    # Deadline-truncated runs (possibly with zero attack iterations) would skew the history and rollups
+    if response_data.get('deadline_reached'):
+        print("⏱️  Deadline reached; assessment not recorded in history")
+        return
+    for attack_summary in response_data.get('attacks') or [response_data]:
+        persist_history_record(clerk_claims, model_id, attack_summary['attack_type'], attack_summary)
 
 def load_custom_pytorch_model(model_path, num_classes=1000, input_size=224):
     """Load a custom PyTorch model (.pt or .pth file)"""
-    ensure_ml_dependencies()
+    ensure_inference_dependencies()
     try:
         # Try to load the model directly
         loaded = torch.load(model_path, map_location=device, weights_only=False)
@@ -365,10 +1046,9 @@ def load_custom_pytorch_model(model_path, num_classes=1000, input_size=224):
 
 def load_custom_keras_model(model_path):
     """Load a custom Keras/TensorFlow model (.h5 file)"""
-    ensure_ml_dependencies()
+    ensure_inference_dependencies()
     try:
-        import tensorflow as tf
-        from tensorflow import keras
+        ensure_keras_dependencies()
         
         # Load the Keras model
         keras_model = keras.models.load_model(model_path)
@@ -407,17 +1087,32 @@ def load_custom_keras_model(model_path):
 
 def create_default_processor(input_size=224):
     """Create a default image processor for custom models"""
-    ensure_ml_dependencies()
+    ensure_inference_dependencies()
     class DefaultProcessor:
         def __init__(self, size=224):
             self.size = size
+            self.image_mean = [0.485, 0.456, 0.406]
+            self.image_std = [0.229, 0.224, 0.225]
+            self.resize = transforms.Resize((size, size))
             self.transform = transforms.Compose([
-                transforms.Resize((size, size)),
+                self.resize,
                 transforms.ToTensor(),
-                transforms.Normalize(mean=[0.485, 0.456, 0.406], 
-                                   std=[0.229, 0.224, 0.225])
+                transforms.Normalize(mean=self.image_mean, 
+                                   std=self.image_std)
             ])
         
+        def describe(self):
+            return {
+                'kind': 'DefaultProcessor',
+                'settings': f"resize={self.size}x{self.size}",
+                'rescale_factor': 1 / 255,
+                'image_mean': self.image_mean,
+                'image_std': self.image_std
+            }
+        
+        def resize_image(self, image):
+            return self.resize(image)
+        
         def __call__(self, images, return_tensors="pt", **kwargs):
             if isinstance(images, Image.Image):
                 images = [images]
@@ -433,26 +1128,515 @@ def create_default_processor(input_size=224):
     
     return DefaultProcessor(input_size)
 
-def get_random_images(num_images=10):
-    """Get random images from the attack folder"""
+class AssessmentError(Exception):
+    """Raised when a threat assessment cannot run; carries the JSON error payload."""
+
+    def __init__(self, payload, status_code=400, headers=None):
+        super().__init__(payload.get('message') or payload.get('error'))
+        self.payload = payload
+        self.status_code = status_code
+        self.headers = headers or {}
+
+class ModelLoadError(AssessmentError):
+    """Raised when an assessment model cannot be loaded."""
+
+class AssessmentCancelled(AssessmentError):
+    """Raised at a cancellation checkpoint once an assessment has been cancelled."""
+
+    def __init__(self):
+        super().__init__({
+            'error': 'Assessment cancelled',
+            'message': 'The assessment was cancelled before it finished.'
+        }, 409)
+
+class ModelCache:
+    """Process-wide LRU cache of loaded models and processors bounded by a memory budget."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._load_locks = {}
+        self._lock = threading.RLock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry['value']
+
+    def put(self, key, value, size_bytes):
+        with self._lock:
+            if key in self._entries:
+                self.current_bytes -= self._entries.pop(key)['size_bytes']
+
+            if size_bytes > self.max_bytes:
+                print(f"⚠️ Model ({size_bytes / 1024 ** 2:.0f}MB) exceeds cache budget, not caching")
+                return
+
+            while self._entries and self.current_bytes + size_bytes > self.max_bytes:
+                evicted_key, evicted = self._entries.popitem(last=False)
+                self.current_bytes -= evicted['size_bytes']
+                self.evictions += 1
+                print(f"♻️ Evicted cached model: {evicted_key[1]}")
+
+            self._entries[key] = {'value': value, 'size_bytes': size_bytes}
+            self.current_bytes += size_bytes
+
+    def has_model(self, model_source, model_id):
+        with self._lock:
+            return any(key[0] == model_source and key[1] == model_id for key in self._entries)
+
+    def load_lock(self, model_source, model_id):
+        """Per-model lock serializing loads so a model is only loaded once at a time."""
+        with self._lock:
+            return self._load_locks.setdefault((model_source, model_id), threading.Lock())
+
+    def invalidate(self, model_source, model_id):
+        """Drop every cached entry for a model, whatever its fingerprint or input size."""
+        with self._lock:
+            stale_keys = [key for key in self._entries if key[0] == model_source and key[1] == model_id]
+            for key in stale_keys:
+                self.current_bytes -= self._entries.pop(key)['size_bytes']
+            return len(stale_keys)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'current_mb': round(self.current_bytes / 1024 ** 2, 2),
+                'max_mb': round(self.max_bytes / 1024 ** 2, 2),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+MODEL_CACHE = ModelCache(MODEL_CACHE_MAX_MB * 1024 * 1024)
+
+def estimate_model_bytes(model):
+    """Estimate the resident size of a loaded model's weights."""
+    keras_model = getattr(model, 'keras_model', None)
+    if keras_model is not None:
+        return int(keras_model.count_params()) * 4
+
+    total = sum(p.numel() * p.element_size() for p in model.parameters())
+    total += sum(b.numel() * b.element_size() for b in model.buffers())
+    return total
+
+def load_assessment_model(model_id, model_source='huggingface'):
+    """Load (or fetch from MODEL_CACHE) the model and processor for an assessment."""
+    ensure_inference_dependencies()
+    # Concurrent requests for the same model wait for one load instead of each loading a copy
+    with MODEL_CACHE.load_lock(model_source, model_id):
+        return _load_assessment_model(model_id, model_source)
+
+def _load_assessment_model(model_id, model_source):
+    try:
+        if model_source == 'custom':
+            model_info = MODEL_REGISTRY.get(model_id)
+            if model_info is None:
+                raise ModelLoadError({
+                    'error': 'Model not found',
+                    'message': f'Custom model "{model_id}" not found. Please upload the model first.'
+                }, 404)
+
+            filepath = os.path.join(MODELS_FOLDER, model_info['filename'])
+
+            if not os.path.exists(filepath):
+                raise ModelLoadError({
+                    'error': 'Model file not found',
+                    'message': f'Model file for "{model_info["name"]}" not found on disk.'
+                }, 404)
+
+            file_stat = os.stat(filepath)
+            cache_key = ('custom', model_id, (file_stat.st_mtime_ns, file_stat.st_size), model_info['input_size'])
+            cached = MODEL_CACHE.get(cache_key)
+            if cached is not None:
+                print(f"♻️ Using cached custom model: {model_info['name']}")
+                return cached
+
+            file_ext = model_info['file_type']
+            if file_ext in ['pt', 'pth']:
+                model = load_custom_pytorch_model(filepath, model_info['num_classes'], model_info['input_size'])
+            elif file_ext in ['h5', 'keras']:
+                model = load_custom_keras_model(filepath)
+            else:
+                raise ModelLoadError({
+                    'error': 'Unsupported model format',
+                    'message': f'Model format "{file_ext}" is not supported.'
+                })
+
+            # Create default processor for custom models
+            processor = create_default_processor(model_info['input_size'])
+            print(f"✅ Custom model loaded successfully: {model_info['name']}")
+        else:
+            # Keyed by the resolved commit hash, so an updated model on the Hub is not served stale
+            revision = model_content_hash(model_id, 'huggingface')
+            cached = MODEL_CACHE.get(('huggingface', model_id, revision, None)) if revision else None
+            if cached is not None:
+                print(f"♻️ Using cached Hugging Face model: {model_id}")
+                return cached
+
+            processor = AutoImageProcessor.from_pretrained(model_id)
+            model = AutoModelForImageClassification.from_pretrained(model_id)
+            # Loading may download a newer commit, so resolve the key again afterwards and drop
+            # the superseded revision
+            cache_key = ('huggingface', model_id, model_content_hash(model_id, 'huggingface'), None)
+            MODEL_CACHE.invalidate('huggingface', model_id)
+            print(f"✅ Hugging Face model loaded successfully")
+    except ModelLoadError:
+        raise
+    except OSError as e:
+        error_msg = str(e)
+        if "does not appear to have a file named preprocessor_config.json" in error_msg or "does not appear to have a file named config.json" in error_msg:
+            raise ModelLoadError({
+                'error': 'Invalid model type',
+                'message': f'The model "{model_id}" is not an image classification model. Please use a vision model like:\n• google/vit-base-patch16-224\n• microsoft/resnet-50\n• facebook/convnext-tiny-224',
+                'details': 'This tool only supports image classification models from Hugging Face Hub.'
+            })
+        raise ModelLoadError({
+            'error': 'Model loading failed',
+            'message': f'Failed to load model "{model_id}". Please verify the model ID exists on Hugging Face Hub.',
+            'details': error_msg
+        })
+    except Exception as e:
+        raise ModelLoadError({
+            'error': 'Model loading failed',
+            'message': f'An unexpected error occurred while loading the model.',
+            'details': str(e)
+        })
+
+    model.to(device)
+    model.eval()
+    MODEL_CACHE.put(cache_key, (model, processor), estimate_model_bytes(model))
+    return model, processor
+
+_attack_image_listing = {'mtime_ns': None, 'files': []}
+_attack_image_listing_lock = threading.Lock()
+
+def list_attack_images():
+    """List image files in the attack folder, re-reading the directory only when it changes."""
     if not os.path.exists(ATTACK_IMAGES_FOLDER):
         os.makedirs(ATTACK_IMAGES_FOLDER)
         return []
     
-    # Get all image files
-    image_extensions = ['.jpg', '.jpeg', '.png', '.bmp', '.gif']
-    all_images = [f for f in os.listdir(ATTACK_IMAGES_FOLDER) 
-                  if os.path.splitext(f.lower())[1] in image_extensions]
+    mtime_ns = os.stat(ATTACK_IMAGES_FOLDER).st_mtime_ns
+    with _attack_image_listing_lock:
+        if _attack_image_listing['mtime_ns'] != mtime_ns:
+            image_extensions = ['.jpg', '.jpeg', '.png', '.bmp', '.gif']
+            _attack_image_listing['files'] = sorted(
+                f for f in os.listdir(ATTACK_IMAGES_FOLDER)
+                if os.path.splitext(f.lower())[1] in image_extensions
+            )
+            _attack_image_listing['mtime_ns'] = mtime_ns
+        return _attack_image_listing['files']
+
+def get_random_images(num_images=10, seed=None):
+    """Get random images from the attack folder (all of them when num_images is None)"""
+    all_images = list_attack_images()
     
     if not all_images:
         return []
     
-    # Select random images
-    num_to_select = min(num_images, len(all_images))
-    selected_images = random.sample(all_images, num_to_select)
+    # Select random images, reproducibly when a seed is given
+    rng = random.Random(seed) if seed is not None else random
+    num_to_select = len(all_images) if num_images is None else min(num_images, len(all_images))
+    selected_images = rng.sample(all_images, num_to_select)
     
     return [os.path.join(ATTACK_IMAGES_FOLDER, img) for img in selected_images]
 
+def describe_processor(processor):
+    """
+    Describe how a processor turns an image into pixel values, split into a geometric
+    step (resize/crop, cacheable as uint8) and a rescale/normalize step. Returns None
+    for processors whose output cannot be reproduced from a cached uint8 image.
+    """
+    if hasattr(processor, 'describe'):
+        return processor.describe()
+    
+    if not hasattr(processor, 'to_dict') or not hasattr(processor, 'image_mean'):
+        return None
+    
+    try:
+        settings = processor.to_dict()
+    except Exception:
+        return None
+    
+    return {
+        'kind': type(processor).__name__,
+        'settings': json.dumps(settings, sort_keys=True, default=str),
+        'rescale_factor': float(processor.rescale_factor) if getattr(processor, 'do_rescale', True) else 1.0,
+        'image_mean': list(processor.image_mean) if getattr(processor, 'do_normalize', True) else None,
+        'image_std': list(processor.image_std) if getattr(processor, 'do_normalize', True) else None
+    }
+
+def prepare_uint8_image(processor, image):
+    """Apply only the resize/crop step of a processor, returning an H x W x 3 uint8 array."""
+    if hasattr(processor, 'resize_image'):
+        return np.asarray(processor.resize_image(image), dtype=np.uint8)
+    
+    pixel_values = processor(images=[image], do_rescale=False, do_normalize=False, return_tensors="pt")['pixel_values'][0]
+    array = np.asarray(pixel_values, dtype=np.float32).transpose(1, 2, 0)
+    return np.clip(np.rint(array), 0, 255).astype(np.uint8)
+
+def normalize_uint8_batch(config, batch):
+    """Turn an N x H x W x 3 uint8 batch into normalized N x C x H x W pixel values."""
+    pixel_values = torch.from_numpy(batch).permute(0, 3, 1, 2).float()
+    pixel_values.mul_(config['rescale_factor'])
+    if config['image_mean'] is not None:
+        mean = torch.tensor(config['image_mean'], dtype=torch.float32).view(1, -1, 1, 1)
+        std = torch.tensor(config['image_std'], dtype=torch.float32).view(1, -1, 1, 1)
+        pixel_values.sub_(mean).div_(std)
+    return pixel_values.contiguous()
+
+def processor_decode_size(processor):
+    """Smallest edge length a processor needs before it resizes, used as the JPEG draft target."""
+    sizes = []
+    for attr in ('size', 'crop_size'):
+        value = getattr(processor, attr, None)
+        if isinstance(value, (int, float)):
+            sizes.append(value)
+        elif value is not None:
+            for key in ('height', 'width', 'shortest_edge', 'longest_edge'):
+                edge = value.get(key) if isinstance(value, dict) else getattr(value, key, None)
+                if isinstance(edge, (int, float)):
+                    sizes.append(edge)
+    if not sizes:
+        return None
+    
+    size = max(sizes)
+    crop_pct = getattr(processor, 'crop_pct', None)
+    if crop_pct:
+        size = size / crop_pct
+    return int(math.ceil(size))
+
+def decode_attack_image(image_path, target_size=None):
+    """
+    Decode an image as RGB. For JPEGs, draft mode lets the decoder scale down by 1/2, 1/4
+    or 1/8 while keeping both edges at least target_size, which is much cheaper than
+    decoding at full resolution and resizing afterwards.
+    """
+    with Image.open(image_path) as image:
+        if target_size:
+            image.draft('RGB', (target_size, target_size))
+        return image.convert('RGB')
+
+def _decode_image_or_none(image_path, target_size):
+    try:
+        return decode_attack_image(image_path, target_size)
+    except Exception as e:
+        print(f"   ❌ Error loading image {os.path.basename(image_path)}: {str(e)}")
+        return None
+
+IMAGE_DECODE_POOL = ThreadPoolExecutor(max_workers=IMAGE_DECODE_WORKERS, thread_name_prefix='image-decode')
+IMAGE_PREFETCH_POOL = ThreadPoolExecutor(max_workers=IMAGE_PREFETCH_WORKERS, thread_name_prefix='image-prefetch')
+
+class AttackImageCache:
+    """
+    Persistent cache of decoded, resized attack images per processor configuration.
+    Each configuration is a memory-mapped N x H x W x 3 uint8 array plus a per-row
+    filled flag and a JSON index of file names. Rows are decoded on first use, and the
+    store is rebuilt (keeping unchanged rows) when the attack folder changes.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self._stores = {}
+        self._unsupported = set()
+        self._lock = threading.Lock()
+
+    def _paths(self, key):
+        base = os.path.join(self.folder, key)
+        return f"{base}.index.json", f"{base}.u8", f"{base}.filled"
+
+    def _open_store(self, key, files, shape):
+        # Other workers may rebuild the same store; the index is read under their lock so a
+        # rebuild is never observed halfway through its three file replacements
+        with exclusive_file_lock(os.path.join(self.folder, key) + '.lock'):
+            return self._open_store_locked(key, files, shape)
+
+    def _open_store_locked(self, key, files, shape):
+        index_path, data_path, filled_path = self._paths(key)
+        if os.path.exists(index_path):
+            try:
+                with open(index_path, 'r') as f:
+                    index = json.load(f)
+                if index['files'] == files and tuple(index['shape']) == tuple(shape):
+                    return self._map_store(key, files, shape, 'r+')
+                old_store = self._map_store(key, index['files'], tuple(index['shape']), 'r')
+            except Exception:
+                old_store = None
+        else:
+            old_store = None
+        
+        # (Re)build the store for the current folder listing, carrying over unchanged rows
+        os.makedirs(self.folder, exist_ok=True)
+        tmp_suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+        data = np.memmap(data_path + tmp_suffix, dtype=np.uint8, mode='w+', shape=(max(len(files), 1),) + tuple(shape))
+        filled = np.memmap(filled_path + tmp_suffix, dtype=np.uint8, mode='w+', shape=(max(len(files), 1),))
+        if old_store is not None and tuple(old_store['shape']) == tuple(shape):
+            for row, name in enumerate(files):
+                old_row = old_store['index'].get(name)
+                if old_row is not None and old_store['filled'][old_row]:
+                    data[row] = old_store['data'][old_row]
+                    filled[row] = 1
+        data.flush()
+        filled.flush()
+        del data, filled
+        os.replace(data_path + tmp_suffix, data_path)
+        os.replace(filled_path + tmp_suffix, filled_path)
+        with open(index_path + tmp_suffix, 'w') as f:
+            json.dump({'files': files, 'shape': list(shape)}, f)
+        os.replace(index_path + tmp_suffix, index_path)
+        return self._map_store(key, files, shape, 'r+')
+
+    def _map_store(self, key, files, shape, mode):
+        _, data_path, filled_path = self._paths(key)
+        rows = max(len(files), 1)
+        return {
+            'files': files,
+            'index': {name: row for row, name in enumerate(files)},
+            'shape': tuple(shape),
+            'data': np.memmap(data_path, dtype=np.uint8, mode=mode, shape=(rows,) + tuple(shape)),
+            'filled': np.memmap(filled_path, dtype=np.uint8, mode=mode, shape=(rows,))
+        }
+
+    def load_batch(self, processor, image_paths):
+        """
+        Return (pixel_values, image_names) for the given attack images, decoding only rows
+        that are not cached yet, or None when the processor cannot be served from the cache.
+        """
+        config = describe_processor(processor)
+        if config is None:
+            return None
+        key = hashlib.sha1(json.dumps(config, sort_keys=True).encode()).hexdigest()[:16]
+        if key in self._unsupported:
+            return None
+        
+        files = list_attack_images()
+        names = [os.path.basename(path) for path in image_paths]
+        target_size = processor_decode_size(processor)
+        
+        with self._lock:
+            store = self._stores.get(key)
+            if store is not None and store['files'] is not files:
+                store = None
+        
+        prepared = {}
+        if store is None:
+            # Prepare one image up front to learn the output shape of this processor
+            for name in names:
+                array = self._decode(processor, name, target_size)
+                if array is not None:
+                    prepared[name] = array
+                    break
+            if not prepared:
+                return None
+            with self._lock:
+                store = self._stores.get(key)
+                if store is None or store['files'] is not files:
+                    store = self._open_store(key, files, next(iter(prepared.values())).shape)
+                    self._stores[key] = store
+        
+        # Decode rows that are not cached yet in parallel
+        missing = [
+            name for name in names
+            if name in store['index'] and name not in prepared and not store['filled'][store['index'][name]]
+        ]
+        prepared.update(zip(missing, IMAGE_DECODE_POOL.map(lambda name: self._decode(processor, name, target_size), missing)))
+        
+        with self._lock:
+            rows = []
+            image_names = []
+            newly_filled = []
+            for name in names:
+                row = store['index'].get(name)
+                if row is None:
+                    continue
+                if not store['filled'][row]:
+                    array = prepared.get(name)
+                    if array is None:
+                        continue
+                    if array.shape != store['shape']:
+                        # Variable output size (e.g. no center crop): serve this processor live
+                        print(f"⚠️ Processor output size varies, disabling image cache for {config['kind']}")
+                        self._unsupported.add(key)
+                        return None
+                    store['data'][row] = array
+                    newly_filled.append(row)
+                rows.append(row)
+                image_names.append(name)
+            
+            # Mark rows filled only once their pixels are on disk
+            if newly_filled:
+                store['data'].flush()
+                store['filled'][newly_filled] = 1
+                store['filled'].flush()
+            
+            if not rows:
+                return None
+            batch = store['data'][rows]
+        
+        return normalize_uint8_batch(config, batch), image_names
+
+    def _decode(self, processor, name, target_size=None):
+        try:
+            image = decode_attack_image(os.path.join(ATTACK_IMAGES_FOLDER, name), target_size)
+            return prepare_uint8_image(processor, image)
+        except Exception as e:
+            print(f"   ❌ Error loading image {name}: {str(e)}")
+            return None
+
+ATTACK_IMAGE_CACHE = AttackImageCache(IMAGE_CACHE_FOLDER)
+
+def prepare_image_batch(processor, image_paths):
+    """Decode and preprocess one batch of attack images, returning (pixel_values, image_names)."""
+    # Preprocessed images come from the memory-mapped cache when the processor allows it
+    cached_batch = ATTACK_IMAGE_CACHE.load_batch(processor, image_paths)
+    if cached_batch is not None:
+        return cached_batch
+    
+    # Load images in parallel, skipping any that cannot be decoded
+    target_size = processor_decode_size(processor)
+    decoded = IMAGE_DECODE_POOL.map(lambda path: _decode_image_or_none(path, target_size), image_paths)
+    images = []
+    image_names = []
+    for image_path, image in zip(image_paths, decoded):
+        if image is not None:
+            images.append(image)
+            image_names.append(os.path.basename(image_path))
+    
+    if not images:
+        return None, []
+    
+    inputs = processor(images=images, return_tensors="pt", padding=True)
+    return inputs['pixel_values'], image_names
+
+def iter_prefetched_batches(processor, path_batches, prefetch=IMAGE_PREFETCH_BATCHES):
+    """
+    Yield one future per batch of image paths, keeping up to `prefetch` batches being
+    decoded in the background so decoding overlaps with attack computation.
+    """
+    path_batches = iter(path_batches)
+    pending = deque()
+    try:
+        for image_paths in path_batches:
+            pending.append(IMAGE_PREFETCH_POOL.submit(prepare_image_batch, processor, image_paths))
+            if len(pending) > max(0, prefetch):
+                yield pending.popleft()
+        while pending:
+            yield pending.popleft()
+    finally:
+        for future in pending:
+            future.cancel()
+
 def resolve_prediction_label(label_map, class_index):
     """Return a human-friendly class label for report output."""
     if isinstance(label_map, dict):
@@ -472,415 +1656,1949 @@ def resolve_attack_image_path(image_name):
     candidate = os.path.join(ATTACK_IMAGES_FOLDER, safe_name)
     return candidate if os.path.exists(candidate) else None
 
+class AssessmentControl:
+    """Run-time limits (deadline and cancellation) checked by the attack loops between iterations."""
+
+    def __init__(self, deadline=None, admission_timeout=ADMISSION_QUEUE_TIMEOUT_SECONDS):
+        # Absolute time.time() after which attacks stop and return what they have
+        self.deadline = deadline
+        # Longest wait for admission before the request is rejected (None waits indefinitely)
+        self.admission_timeout = admission_timeout
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def raise_if_cancelled(self):
+        if self.cancelled:
+            raise AssessmentCancelled()
+
+    def remaining(self):
+        if self.deadline is None:
+            return None
+        return self.deadline - time.time()
+
+    def should_stop(self, reserve_seconds=0.0):
+        """True once cancelled, or when fewer than reserve_seconds are left before the deadline."""
+        return self.cancelled or (self.deadline is not None and time.time() + reserve_seconds >= self.deadline)
+
+class RunningAssessments:
+    """Controls of running assessments by assessment id, so another request can cancel them."""
+
+    def __init__(self):
+        self._running = {}
+        self._lock = threading.Lock()
+
+    def register(self, assessment_id, user_id):
+        with self._lock:
+            if assessment_id in self._running:
+                raise AssessmentError({
+                    'error': 'Assessment id in use',
+                    'message': f'An assessment with id "{assessment_id}" is already running.'
+                }, 409)
+            control = AssessmentControl()
+            self._running[assessment_id] = {'control': control, 'user_id': user_id}
+            return control
+
+    def release(self, assessment_id, control):
+        with self._lock:
+            entry = self._running.get(assessment_id)
+            if entry is not None and entry['control'] is control:
+                del self._running[assessment_id]
+
+    @contextmanager
+    def track(self, assessment_id, user_id):
+        control = self.register(assessment_id, user_id)
+        try:
+            yield control
+        finally:
+            self.release(assessment_id, control)
+
+    def cancel(self, assessment_id, user_id):
+        """Cancel a running assessment owned by user_id; returns False if there is none."""
+        with self._lock:
+            entry = self._running.get(assessment_id)
+            if entry is None or entry['user_id'] != user_id:
+                return False
+            entry['control'].cancel()
+            return True
+
+    def stats(self):
+        with self._lock:
+            return {'running': len(self._running)}
+
+RUNNING_ASSESSMENTS = RunningAssessments()
+
+_frozen_models = {}
+_frozen_models_lock = threading.Lock()
+
+@contextmanager
+def frozen_parameters(model):
+    """
+    Disable requires_grad on model parameters so attacks only compute input gradients.
+    Cached models are shared between requests, so the original flags are restored
+    only when the last concurrent user exits.
+    """
+    key = id(model)
+    with _frozen_models_lock:
+        entry = _frozen_models.get(key)
+        if entry is None:
+            entry = {'count': 0, 'flags': [(param, param.requires_grad) for param in model.parameters()]}
+            for param, _ in entry['flags']:
+                param.requires_grad_(False)
+            _frozen_models[key] = entry
+        entry['count'] += 1
+    try:
+        yield model
+    finally:
+        with _frozen_models_lock:
+            entry['count'] -= 1
+            if entry['count'] == 0:
+                for param, requires_grad in entry['flags']:
+                    param.requires_grad_(requires_grad)
+                del _frozen_models[key]
+
 class AdversarialAttacks:
-    def __init__(self, model, processor):
-        ensure_ml_dependencies()
+    def __init__(self, model, processor, micro_batch_size=ATTACK_BATCH_SIZE, early_exit=False, control=None):
+        ensure_inference_dependencies()
         self.model = model.to(device)
         self.processor = processor
+        self.micro_batch_size = max(1, int(micro_batch_size))
+        self.early_exit = early_exit
+        self.control = control
+        self.pass_counts = {'forward': 0, 'forward_samples': 0, 'backward': 0}
+        # Per-sample iteration counts and cut-short flags of the most recent attack call
+        self.last_iterations = []
+        self.last_partial = []
+        # Input gradient sign of the most recent FGSM call, reused by epsilon sweeps
+        self.last_gradient_sign = None
+        # Robustness-curve results of the most recent attack_and_evaluate_all call with epsilons
+        self.last_sweep_results = {}
+        # Cleared once the model turns out not to support vmap, see _candidate_gradients
+        self.batched_gradients = True
         self.model.eval()
     
-    def fgsm_attack(self, image_tensor, epsilon=0.03):
+    def _should_stop(self, iteration_started=None):
         """
-        Fast Gradient Sign Method (FGSM) Attack
+        Checkpoint between attack iterations. iteration_started is when the previous
+        iteration began; its duration is the expected cost of the next one, which is
+        not started if it would overrun the deadline.
         """
-        image_tensor = image_tensor.to(device)
-        image_tensor.requires_grad = True
+        if self.control is None:
+            return False
+        return self.control.should_stop(time.time() - iteration_started if iteration_started else 0.0)
+    
+    def _raise_if_cancelled(self):
+        """Checkpoint between micro-batches, attacks and sweep points."""
+        if self.control is not None:
+            self.control.raise_if_cancelled()
+    
+    def _forward(self, images):
+        """Run the model and count the pass."""
+        self.pass_counts['forward'] += 1
+        self.pass_counts['forward_samples'] += images.shape[0]
+        return self.model(images).logits
+    
+    def _input_gradient(self, loss, images, retain_graph=False):
+        """Gradient of loss w.r.t. the input images only, counting the pass."""
+        self.pass_counts['backward'] += 1
+        return torch.autograd.grad(loss, images, retain_graph=retain_graph)[0]
+    
+    def _candidate_gradients(self, f_k, images):
+        """
+        Gradients of every column of f_k w.r.t. the input images, shaped (N, K, ...).
+        All K columns are differentiated in one vmapped backward pass; models with
+        operations vmap does not support fall back to one backward pass per column.
+        """
+        num_candidates = f_k.shape[1]
+        if self.batched_gradients:
+            one_hot = torch.eye(num_candidates, device=f_k.device, dtype=f_k.dtype)
+            grad_outputs = one_hot.unsqueeze(1).expand(num_candidates, *f_k.shape)
+            try:
+                gradients = torch.autograd.grad(f_k, images, grad_outputs=grad_outputs,
+                                                retain_graph=True, is_grads_batched=True)[0]
+                self.pass_counts['backward'] += 1
+                return gradients.transpose(0, 1)
+            except RuntimeError as e:
+                print(f"⚠️ Batched DeepFool gradients unavailable, using one backward pass per class: {e}")
+                self.batched_gradients = False
+        return torch.stack([
+            self._input_gradient(f_k[:, k].sum(), images, retain_graph=k < num_candidates - 1)
+            for k in range(num_candidates)
+        ], dim=1)
+    
+    def _attack_micro_batch(self, attack_type, micro_batch, clean_logits=None):
+        if attack_type == 'fgsm':
+            return self.fgsm_attack(micro_batch, clean_logits=clean_logits, return_logits=True)
+        elif attack_type == 'pgd':
+            return self.pgd_attack(micro_batch, clean_logits=clean_logits, return_logits=True)
+        elif attack_type == 'deepfool':
+            return self.deepfool_attack(micro_batch, clean_logits=clean_logits, return_logits=True)
+        raise ValueError(f"Invalid attack type: {attack_type}")
+    
+    def attack_and_evaluate_all(self, attack_types, image_batch, sweep_epsilons=None):
+        """
+        Run several attacks against the same batch, sharing the clean logits of the first
+        attack with the rest. Returns {attack_type: per-sample results}
+        
+        With sweep_epsilons, the attacks in SWEEP_ATTACKS are also evaluated at every
+        epsilon while the micro-batch is at hand, FGSM reusing the gradient sign of the
+        main pass; those results are left in last_sweep_results.
+        """
+        results = {attack_type: [] for attack_type in attack_types}
+        sweep_types = [attack_type for attack_type in attack_types if sweep_epsilons and attack_type in SWEEP_ATTACKS]
+        self.last_sweep_results = {attack_type: [[] for _ in sweep_epsilons] for attack_type in sweep_types}
+        with frozen_parameters(self.model):
+            for start in range(0, image_batch.shape[0], self.micro_batch_size):
+                self._raise_if_cancelled()
+                micro_batch = image_batch[start:start + self.micro_batch_size]
+                clean_logits = None
+                for attack_type in attack_types:
+                    adversarial_batch, clean_logits = self._attack_micro_batch(attack_type, micro_batch, clean_logits=clean_logits)
+                    self._raise_if_cancelled()
+                    batch_results = self.evaluate_batch(micro_batch, adversarial_batch, clean_logits=clean_logits)
+                    self._raise_if_cancelled()
+                    for result, iterations, partial in zip(batch_results, self.last_iterations, self.last_partial):
+                        result['iterations'] = iterations
+                        result['partial'] = partial
+                    results[attack_type].extend(batch_results)
+                    
+                    if attack_type in sweep_types:
+                        gradient_sign = self.last_gradient_sign if attack_type == 'fgsm' else None
+                        point_results = self._sweep_micro_batch(attack_type, micro_batch, sweep_epsilons,
+                                                                clean_logits=clean_logits, gradient_sign=gradient_sign)
+                        for curve_results, epsilon_results in zip(self.last_sweep_results[attack_type], point_results):
+                            curve_results.extend(epsilon_results)
         
-        # Forward pass
-        outputs = self.model(image_tensor)
-        logits = outputs.logits
-        predicted_class = logits.argmax(dim=1)
+        return results
+    
+    def _sweep_micro_batch(self, attack_type, micro_batch, epsilons, clean_logits=None, gradient_sign=None):
+        """Per-epsilon results for one micro-batch; each result carries whether it was cut short."""
+        micro_batch = micro_batch.to(device)
+        results = []
+        if attack_type == 'fgsm':
+            if gradient_sign is None:
+                gradient_sign, clean_logits = self._fgsm_gradient_sign(micro_batch, clean_logits)
+            for epsilon in epsilons:
+                self._raise_if_cancelled()
+                adversarial_batch = torch.add(micro_batch, gradient_sign, alpha=epsilon).clamp_(0, 1)
+                epsilon_results = self.evaluate_batch(micro_batch, adversarial_batch, clean_logits=clean_logits)
+                for result in epsilon_results:
+                    result['partial'] = False
+                results.append(epsilon_results)
+        elif attack_type == 'pgd':
+            perturbation = torch.zeros_like(micro_batch)
+            for index, epsilon in enumerate(epsilons):
+                self._raise_if_cancelled()
+                # Later epsilons start next to a strong solution, so they need fewer steps
+                num_iter = 10 if index == 0 else PGD_SWEEP_WARM_ITERATIONS
+                adversarial_batch, clean_logits = self.pgd_attack(
+                    micro_batch, epsilon=epsilon, num_iter=num_iter, clean_logits=clean_logits,
+                    return_logits=True, perturbation=perturbation)
+                epsilon_results = self.evaluate_batch(micro_batch, adversarial_batch, clean_logits=clean_logits)
+                # A point computed after a deadline or stop may have run no iterations at all
+                for result, partial in zip(epsilon_results, self.last_partial):
+                    result['partial'] = partial
+                results.append(epsilon_results)
+        else:
+            raise ValueError(f"Epsilon sweeps are not supported for {attack_type}")
+        return results
+    
+    def _fgsm_gradient_sign(self, image_tensor, clean_logits=None):
+        """Sign of the FGSM input gradient, together with the logits of the clean image."""
+        image_tensor = image_tensor.to(device).detach().requires_grad_(True)
         
-        # Calculate loss
-        loss = F.cross_entropy(logits, predicted_class)
+        # Forward pass (on the clean image, so its logits double as the clean prediction)
+        logits = self._forward(image_tensor)
+        predicted_class = (clean_logits if clean_logits is not None else logits).argmax(dim=1)
         
-        # Backward pass
-        self.model.zero_grad()
-        loss.backward()
+        # Calculate loss (summed so each sample's gradient is independent of batch size)
+        loss = F.cross_entropy(logits, predicted_class, reduction='sum')
+        
+        # Backward pass (input gradient only)
+        return self._input_gradient(loss, image_tensor).sign_(), logits.detach()
+    
+    def fgsm_attack(self, image_tensor, epsilon=0.03, clean_logits=None, return_logits=False):
+        """
+        Fast Gradient Sign Method (FGSM) Attack
+        """
+        image_tensor = image_tensor.to(device).detach()
+        gradient_sign, logits = self._fgsm_gradient_sign(image_tensor, clean_logits)
         
         # Create adversarial example
-        sign_data_grad = image_tensor.grad.data.sign()
-        perturbed_image = image_tensor + epsilon * sign_data_grad
-        perturbed_image = torch.clamp(perturbed_image, 0, 1)
+        perturbed_image = torch.add(image_tensor, gradient_sign, alpha=epsilon).clamp_(0, 1)
+        self.last_gradient_sign = gradient_sign
+        self.last_iterations = [1] * image_tensor.shape[0]
+        self.last_partial = [False] * image_tensor.shape[0]
         
-        return perturbed_image.detach()
+        if return_logits:
+            return perturbed_image, logits
+        return perturbed_image
     
-    def pgd_attack(self, image_tensor, epsilon=0.03, alpha=0.01, num_iter=10):
+    def pgd_attack(self, image_tensor, epsilon=0.03, alpha=0.01, num_iter=10, clean_logits=None, return_logits=False,
+                   perturbation=None, early_exit=None):
         """
         Projected Gradient Descent (PGD) Attack
+        
+        A `perturbation` tensor warm-starts the attack and is updated in place. With
+        early_exit, samples whose prediction has flipped are dropped from the batch and
+        keep their adversarial image.
         """
-        image_tensor = image_tensor.to(device)
-        original_image = image_tensor.clone().detach()
+        if early_exit is None:
+            early_exit = self.early_exit
+        if early_exit:
+            return self._pgd_attack_early_exit(image_tensor, epsilon, alpha, num_iter, clean_logits, return_logits, perturbation)
         
-        # Get original prediction
-        with torch.no_grad():
-            outputs = self.model(image_tensor)
-            logits = outputs.logits
-            target_class = logits.argmax(dim=1)
+        original_image = image_tensor.to(device).detach()
         
-        # Initialize perturbed image
-        perturbed_image = image_tensor.clone().detach()
+        # Get original prediction (reused when the caller already has it)
+        if clean_logits is None and (num_iter == 0 or perturbation is not None):
+            with torch.no_grad():
+                clean_logits = self._forward(original_image)
+        target_class = clean_logits.argmax(dim=1) if clean_logits is not None else None
+        
+        # Pre-allocated perturbation and adversarial image buffers, updated in place
+        if perturbation is None:
+            perturbation = torch.zeros_like(original_image)
+        perturbation.clamp_(-epsilon, epsilon)
+        perturbed_image = torch.add(original_image, perturbation).clamp_(0, 1)
         
         # Iterative attack
+        completed_iterations = 0
+        iteration_started = None
         for i in range(num_iter):
-            perturbed_image.requires_grad = True
+            if self._should_stop(iteration_started):
+                break
+            iteration_started = time.time()
+            perturbed_image.requires_grad_(True)
             
             # Forward pass
-            outputs = self.model(perturbed_image)
-            logits = outputs.logits
-            loss = F.cross_entropy(logits, target_class)
+            logits = self._forward(perturbed_image)
+            if target_class is None:
+                # The first iteration runs on the clean image, so it doubles as the clean prediction
+                clean_logits = logits.detach()
+                target_class = clean_logits.argmax(dim=1)
+            loss = F.cross_entropy(logits, target_class, reduction='sum')
+            
+            # Backward pass (input gradient only)
+            input_grad = self._input_gradient(loss, perturbed_image)
+            perturbed_image.requires_grad_(False)
+            
+            # Update perturbed image and project back to epsilon ball
+            with torch.no_grad():
+                perturbation.add_(input_grad.sign_(), alpha=alpha).clamp_(-epsilon, epsilon)
+                torch.add(original_image, perturbation, out=perturbed_image).clamp_(0, 1)
+                perturbation.copy_(perturbed_image).sub_(original_image)
+            completed_iterations += 1
+        
+        self.last_iterations = [completed_iterations] * original_image.shape[0]
+        self.last_partial = [completed_iterations < num_iter] * original_image.shape[0]
+        
+        if return_logits:
+            return perturbed_image, clean_logits
+        return perturbed_image
+    
+    def _pgd_attack_early_exit(self, image_tensor, epsilon, alpha, num_iter, clean_logits, return_logits, perturbation):
+        """PGD over a shrinking active set: each iteration only attacks samples that still hold their class."""
+        original_image = image_tensor.to(device).detach()
+        
+        if clean_logits is None and (num_iter == 0 or perturbation is not None):
+            with torch.no_grad():
+                clean_logits = self._forward(original_image)
+        target_class = clean_logits.argmax(dim=1) if clean_logits is not None else None
+        
+        if perturbation is None:
+            perturbation = torch.zeros_like(original_image)
+        perturbation.clamp_(-epsilon, epsilon)
+        perturbed_image = torch.add(original_image, perturbation).clamp_(0, 1)
+        
+        # Indices of samples that have not flipped yet and their gradient step counts
+        active = torch.arange(original_image.shape[0], device=device)
+        iterations = torch.zeros(original_image.shape[0], dtype=torch.long, device=device)
+        partial = torch.zeros(original_image.shape[0], dtype=torch.bool, device=device)
+        
+        iteration_started = None
+        for i in range(num_iter):
+            if self._should_stop(iteration_started):
+                partial[active] = True
+                break
+            iteration_started = time.time()
+            active_images = perturbed_image[active].requires_grad_(True)
+            logits = self._forward(active_images)
+            if target_class is None:
+                # The first iteration runs on the clean image, so it doubles as the clean prediction
+                clean_logits = logits.detach()
+                target_class = clean_logits.argmax(dim=1)
+            
+            # Flipped samples are frozen; the rest take a gradient step
+            active_targets = target_class[active]
+            still_correct = logits.detach().argmax(dim=1) == active_targets
+            if not still_correct.any():
+                break
+            loss = F.cross_entropy(logits[still_correct], active_targets[still_correct], reduction='sum')
+            input_grad = self._input_gradient(loss, active_images)[still_correct]
+            active = active[still_correct]
+            
+            with torch.no_grad():
+                active_original = original_image[active]
+                active_perturbation = perturbation[active].add_(input_grad.sign_(), alpha=alpha).clamp_(-epsilon, epsilon)
+                updated = torch.add(active_original, active_perturbation).clamp_(0, 1)
+                perturbed_image[active] = updated
+                perturbation[active] = updated - active_original
+            iterations[active] += 1
+        
+        self.last_iterations = iterations.tolist()
+        self.last_partial = partial.tolist()
+        
+        if return_logits:
+            return perturbed_image, clean_logits
+        return perturbed_image
+    
+    def deepfool_attack(self, image_tensor, num_classes=10, overshoot=0.02, max_iter=50, clean_logits=None, return_logits=False):
+        """
+        DeepFool Attack - Finds minimal perturbation
+        
+        Each iteration runs one forward pass over the unflipped samples and a single
+        batched backward pass that yields the gradients of all candidate classes from
+        the same graph, so activations are stored for one micro-batch only. Samples drop
+        out of the active set as soon as their prediction flips.
+        """
+        image_tensor = image_tensor.to(device)
+        perturbed_image = image_tensor.clone().detach()
+        
+        if clean_logits is None:
+            with torch.no_grad():
+                clean_logits = self._forward(perturbed_image)
+        original_classes = clean_logits.argmax(dim=1)
+        
+        # Get number of classes from model
+        num_classes = min(num_classes, clean_logits.shape[1])
+        
+        # Indices of samples whose prediction has not flipped yet
+        active = torch.arange(perturbed_image.shape[0], device=device)
+        iterations = torch.zeros(perturbed_image.shape[0], dtype=torch.long, device=device)
+        partial = torch.zeros(perturbed_image.shape[0], dtype=torch.bool, device=device)
+        iteration = 0
+        iteration_started = None
+        
+        while iteration < max_iter and active.numel() > 0:
+            if self._should_stop(iteration_started):
+                partial[active] = True
+                break
+            iteration_started = time.time()
+            active_images = perturbed_image[active]
+            active_original = original_classes[active]
+            num_active = active.numel()
+            
+            active_input = active_images.clone().requires_grad_(True)
+            logits = self._forward(active_input)
+            
+            # Get top classes
+            top_classes = torch.topk(logits.detach(), num_classes, dim=1).indices
+            rows = torch.arange(num_active, device=device)
             
-            # Backward pass
-            self.model.zero_grad()
-            loss.backward()
+            # Calculate w_k and f_k for every candidate, reusing the forward graph
+            f_k = logits.gather(1, top_classes) - logits[rows, active_original].unsqueeze(1)
+            w_k = self._candidate_gradients(f_k, active_input)
+            w_norms = w_k.flatten(2).norm(dim=2)
+            
+            # Calculate perturbation, ignoring the original class itself
+            pert_k = f_k.detach().abs() / (w_norms + 1e-8)
+            pert_k = pert_k.masked_fill(top_classes == active_original.unsqueeze(1), float('inf'))
+            pert, best = pert_k.min(dim=1)
             
             # Update perturbed image
             with torch.no_grad():
-                sign_data_grad = perturbed_image.grad.data.sign()
-                perturbed_image = perturbed_image + alpha * sign_data_grad
+                has_candidate = torch.isfinite(pert)
+                pert = torch.where(has_candidate, pert, torch.zeros_like(pert)).view(-1, 1, 1, 1)
+                w = w_k[rows, best]
+                r = (pert + 1e-4) * w / (w_norms[rows, best].view(-1, 1, 1, 1) + 1e-8)
+                r = r * has_candidate.view(-1, 1, 1, 1)
+                updated = torch.clamp(active_images + (1 + overshoot) * r, 0, 1)
+                perturbed_image[active] = updated
                 
-                # Project back to epsilon ball
-                perturbation = torch.clamp(perturbed_image - original_image, -epsilon, epsilon)
-                perturbed_image = torch.clamp(original_image + perturbation, 0, 1)
+                # Check new predictions and keep only samples that have not flipped
+                current_classes = self._forward(updated).argmax(dim=1)
             
-            perturbed_image = perturbed_image.detach()
+            iterations[active] += 1
+            active = active[current_classes == active_original]
+            iteration += 1
+        
+        self.last_iterations = iterations.tolist()
+        self.last_partial = partial.tolist()
         
+        if return_logits:
+            return perturbed_image, clean_logits
         return perturbed_image
     
-    def deepfool_attack(self, image_tensor, num_classes=10, overshoot=0.02, max_iter=50):
-        """
-        DeepFool Attack - Finds minimal perturbation
-        """
-        image_tensor = image_tensor.to(device)
-        perturbed_image = image_tensor.clone().detach()
-        
-        with torch.no_grad():
-            outputs = self.model(perturbed_image)
-            logits = outputs.logits
-            original_class = logits.argmax(dim=1).item()
+    def evaluate_attack(self, original_image, adversarial_image):
+        """
+        Evaluate the success of the attack
+        """
+        return self.evaluate_batch(original_image, adversarial_image)[0]
+    
+    def evaluate_batch(self, original_images, adversarial_images, clean_logits=None):
+        """
+        Evaluate the success of the attack for every sample in a batch
+        """
+        with torch.no_grad():
+            # Original predictions (skipped when the attack already produced them)
+            if clean_logits is None:
+                clean_logits = self._forward(original_images.to(device))
+            original_probs = F.softmax(clean_logits, dim=1)
+            original_confidences, original_preds = original_probs.max(dim=1)
+            
+            # Adversarial predictions
+            adv_logits = self._forward(adversarial_images.to(device))
+            adv_probs = F.softmax(adv_logits, dim=1)
+            adv_confidences, adv_preds = adv_probs.max(dim=1)
+        
+        results = []
+        for original_pred, original_confidence, adv_pred, adv_confidence in zip(
+                original_preds.tolist(), original_confidences.tolist(),
+                adv_preds.tolist(), adv_confidences.tolist()):
+            results.append({
+                'success': original_pred != adv_pred,
+                'original_pred': original_pred,
+                'original_confidence': original_confidence,
+                'adversarial_pred': adv_pred,
+                'adversarial_confidence': adv_confidence
+            })
+        return results
+
+def wilson_interval(successes, trials, confidence=0.95):
+    """Wilson score interval for a binomial proportion."""
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    p = successes / trials
+    denominator = 1 + z * z / trials
+    center = (p + z * z / (2 * trials)) / denominator
+    half_width = z * math.sqrt(p * (1 - p) / trials + z * z / (4 * trials * trials)) / denominator
+    return max(0.0, center - half_width), min(1.0, center + half_width)
+
+def _binomial_cdf(k, trials, p):
+    """P(X <= k) for X ~ Binomial(trials, p), summed in log space."""
+    if k < 0:
+        return 0.0
+    if k >= trials or p <= 0:
+        return 1.0
+    if p >= 1:
+        return 0.0
+    log_p, log_q = math.log(p), math.log1p(-p)
+    log_norm = math.lgamma(trials + 1)
+    return min(1.0, sum(
+        math.exp(log_norm - math.lgamma(i + 1) - math.lgamma(trials - i + 1) + i * log_p + (trials - i) * log_q)
+        for i in range(k + 1)
+    ))
+
+def clopper_pearson_interval(successes, trials, confidence=0.95):
+    """Exact Clopper-Pearson interval, found by bisection on the binomial CDF."""
+    alpha = 1 - confidence
+    
+    def bisect(predicate):
+        low, high = 0.0, 1.0
+        for _ in range(50):
+            mid = (low + high) / 2
+            if predicate(mid):
+                high = mid
+            else:
+                low = mid
+        return (low + high) / 2
+    
+    lower = 0.0 if successes == 0 else bisect(lambda p: 1 - _binomial_cdf(successes - 1, trials, p) >= alpha / 2)
+    upper = 1.0 if successes == trials else bisect(lambda p: _binomial_cdf(successes, trials, p) <= alpha / 2)
+    return lower, upper
+
+def success_rate_interval(successes, trials, confidence=0.95, method='wilson'):
+    """Confidence interval on the attack success rate, in percent."""
+    interval = clopper_pearson_interval if method == 'clopper-pearson' else wilson_interval
+    lower, upper = interval(successes, trials, confidence)
+    return {
+        'lower': lower * 100,
+        'upper': upper * 100,
+        'width': (upper - lower) * 100,
+        'confidence': confidence,
+        'method': method
+    }
+
+def adaptive_stop_reason(interval, max_interval_width):
+    """Return why an adaptive assessment can stop, or None to keep sampling."""
+    if interval['width'] <= max_interval_width:
+        return 'interval_width'
+    if severity_for_success_rate(interval['lower']) == severity_for_success_rate(interval['upper']):
+        return 'severity_determined'
+    return None
+
+def parse_assessment_request(data):
+    """Validate threat assessment request parameters."""
+    data = data or {}
+    model_id = data.get('model_id')
+    attack_type = data.get('attack_type', 'fgsm')
+    model_source = data.get('model_source', 'huggingface')  # 'huggingface' or 'custom'
+    batch_size = data.get('batch_size', ATTACK_BATCH_SIZE)
+    num_images = data.get('num_images', DEFAULT_NUM_IMAGES)
+    seed = data.get('seed')
+    
+    if not model_id:
+        raise AssessmentError({'error': 'Missing model_id'})
+    
+    # attack_type may also be a list of attacks run against the same images in one pass
+    attack_types = attack_type if isinstance(attack_type, list) else [attack_type]
+    attack_types = list(OrderedDict.fromkeys(str(a).lower() for a in attack_types))
+    if not attack_types or any(a not in ('fgsm', 'pgd', 'deepfool') for a in attack_types):
+        raise AssessmentError({'error': 'Invalid attack type'})
+    attack_type = attack_types[0]
+    
+    try:
+        batch_size = min(max(1, int(batch_size)), MAX_ATTACK_BATCH_SIZE)
+    except (TypeError, ValueError):
+        raise AssessmentError({'error': 'Invalid batch_size'})
+    
+    # num_images may be a positive count or "all" (None) to use the whole attack folder
+    if isinstance(num_images, str) and num_images.lower() == 'all':
+        num_images = None
+    else:
+        try:
+            num_images = int(num_images)
+        except (TypeError, ValueError):
+            raise AssessmentError({'error': 'Invalid num_images', 'message': 'num_images must be a positive integer or "all"'})
+        if num_images < 1:
+            raise AssessmentError({'error': 'Invalid num_images', 'message': 'num_images must be a positive integer or "all"'})
+    
+    # Selection is always seeded so every assessment is reproducible from its response;
+    # a fresh random sample is drawn only when the client asks for seed "random"
+    if seed is None:
+        seed = DEFAULT_SAMPLE_SEED
+    elif isinstance(seed, str) and seed.lower() == 'random':
+        seed = random.randrange(2 ** 31)
+    try:
+        seed = int(seed)
+    except (TypeError, ValueError):
+        raise AssessmentError({'error': 'Invalid seed'})
+    
+    # Adaptive mode samples until the success-rate interval is tight enough
+    adaptive = bool(data.get('adaptive', False))
+    if adaptive and 'num_images' not in data:
+        num_images = None
+    interval_method = data.get('interval_method', 'wilson')
+    if interval_method not in ('wilson', 'clopper-pearson'):
+        raise AssessmentError({'error': 'Invalid interval_method', 'message': 'interval_method must be "wilson" or "clopper-pearson"'})
+    try:
+        confidence = float(data.get('confidence', 0.95))
+        max_interval_width = float(data.get('max_interval_width', 10.0))
+        min_images = max(1, int(data.get('min_images', batch_size)))
+    except (TypeError, ValueError):
+        raise AssessmentError({'error': 'Invalid adaptive sampling parameters'})
+    if not 0 < confidence < 1:
+        raise AssessmentError({'error': 'Invalid confidence', 'message': 'confidence must be between 0 and 1'})
+    
+    # Anytime mode: stop attacking once the deadline passes and return partial results
+    deadline_ms = data.get('deadline_ms')
+    if deadline_ms is not None:
+        try:
+            deadline_ms = int(deadline_ms)
+        except (TypeError, ValueError):
+            raise AssessmentError({'error': 'Invalid deadline_ms'})
+        if deadline_ms < 1:
+            raise AssessmentError({'error': 'Invalid deadline_ms', 'message': 'deadline_ms must be a positive number of milliseconds'})
+    
+    # Clients may choose the id they later cancel by; otherwise one is generated
+    assessment_id = data.get('assessment_id') or uuid.uuid4().hex
+    if not re.fullmatch(r'[A-Za-z0-9_-]{1,64}', str(assessment_id)):
+        raise AssessmentError({'error': 'Invalid assessment_id', 'message': 'assessment_id must be 1-64 letters, digits, "-" or "_"'})
+    
+    # Epsilon sweep: FGSM/PGD are additionally evaluated at every epsilon for a robustness curve
+    epsilons = data.get('epsilons')
+    if epsilons is not None:
+        try:
+            epsilons = sorted(set(float(epsilon) for epsilon in epsilons))
+        except (TypeError, ValueError):
+            raise AssessmentError({'error': 'Invalid epsilons', 'message': 'epsilons must be a list of numbers'})
+        if not epsilons or len(epsilons) > SWEEP_MAX_EPSILONS or not all(0 < epsilon <= 1 for epsilon in epsilons):
+            raise AssessmentError({
+                'error': 'Invalid epsilons',
+                'message': f'epsilons must hold 1-{SWEEP_MAX_EPSILONS} values between 0 and 1'
+            })
+        if not any(a in SWEEP_ATTACKS for a in attack_types):
+            raise AssessmentError({'error': 'Invalid epsilons', 'message': 'Epsilon sweeps require an FGSM or PGD attack'})
+    
+    return {
+        'model_id': model_id,
+        'attack_type': attack_type,
+        'attack_types': attack_types,
+        'model_source': model_source,
+        'batch_size': batch_size,
+        'num_images': num_images,
+        'seed': seed,
+        'adaptive': adaptive,
+        'confidence': confidence,
+        'max_interval_width': max_interval_width,
+        'min_images': min_images,
+        'interval_method': interval_method,
+        'use_cache': bool(data.get('use_cache', True)),
+        'early_exit': bool(data.get('early_exit', False)),
+        'deadline_ms': deadline_ms,
+        'epsilons': epsilons,
+        'assessment_id': str(assessment_id)
+    }
+
+def estimate_model_weight_bytes(model_id, model_source='huggingface'):
+    """
+    Estimate the memory a model's weights need once loaded (parameter count x dtype, read
+    off the weight files), or 0 when the model is already resident in MODEL_CACHE.
+    """
+    if MODEL_CACHE.has_model(model_source, model_id):
+        return 0
+    
+    if model_source == 'custom':
+        model_info = MODEL_REGISTRY.get(model_id) or {}
+        filepath = os.path.join(MODELS_FOLDER, model_info.get('filename', ''))
+        if model_info and os.path.isfile(filepath):
+            return os.path.getsize(filepath)
+        return int(model_info.get('file_size') or 0)
+    
+    try:
+        from huggingface_hub.constants import HF_HUB_CACHE
+        repo_folder = os.path.join(HF_HUB_CACHE, 'models--' + model_id.replace('/', '--'))
+        with open(os.path.join(repo_folder, 'refs', 'main'), 'r') as f:
+            snapshot = os.path.join(repo_folder, 'snapshots', f.read().strip())
+        # A repository may ship the same weights in several formats; one of them is loaded
+        weight_sizes = {}
+        for name in os.listdir(snapshot):
+            extension = os.path.splitext(name)[1]
+            if extension in ('.safetensors', '.bin', '.h5', '.msgpack'):
+                weight_sizes[extension] = weight_sizes.get(extension, 0) + os.path.getsize(os.path.join(snapshot, name))
+        if weight_sizes:
+            return min(weight_sizes.values())
+    except Exception:
+        pass
+    return ADMISSION_DEFAULT_MODEL_MB * 1024 * 1024
+
+def estimate_activation_bytes(attack_types, batch_size, input_size=224):
+    """Estimate the activation memory of one attack micro-batch."""
+    # DeepFool also keeps one input gradient per candidate class
+    factor = ADMISSION_ACTIVATION_FACTOR + (10 if 'deepfool' in attack_types else 0)
+    input_bytes = 3 * input_size * input_size * 4
+    return batch_size * input_bytes * factor
+
+def estimate_assessment_bytes(params, model_id=None, model_source=None):
+    """Estimated peak memory of an assessment: model weights plus attack activations."""
+    model_id = model_id or params['model_id']
+    model_source = model_source or params['model_source']
+    input_size = 224
+    if model_source == 'custom':
+        input_size = int((MODEL_REGISTRY.get(model_id) or {}).get('input_size') or input_size)
+    return (estimate_model_weight_bytes(model_id, model_source) +
+            estimate_activation_bytes(params.get('attack_types') or [params['attack_type']], params['batch_size'], input_size))
+
+class AdmissionController:
+    """
+    Admits memory-heavy work only while the summed estimates of running work fit the
+    budget. Work that does not fit waits in a bounded queue and is rejected with 429 when
+    the queue is full or the wait times out. Oversized work is admitted when nothing else runs.
+    
+    Models stay resident in MODEL_CACHE after their work is released, so the cache's
+    budget (cache_bytes) is carved out of the total and only the rest is handed out to
+    running work. That is also why cached models add no weight bytes to an estimate.
+    """
+
+    def __init__(self, budget_bytes, max_queued, cache_bytes=0):
+        self.budget_bytes = budget_bytes
+        self.cache_bytes = cache_bytes
+        self.available_bytes = max(0, budget_bytes - cache_bytes)
+        self.max_queued = max_queued
+        self.reserved_bytes = 0
+        self.running = 0
+        self.queued = 0
+        self.admitted = 0
+        self.rejected = 0
+        self._condition = threading.Condition()
+
+    def _fits(self, estimated_bytes):
+        return self.running == 0 or self.reserved_bytes + estimated_bytes <= self.available_bytes
+
+    def _rejection(self):
+        self.rejected += 1
+        return AssessmentError({
+            'error': 'Server busy',
+            'message': 'Not enough memory is available to start this work right now. Please retry shortly.',
+            'retry_after': ADMISSION_RETRY_AFTER_SECONDS
+        }, 429, {'Retry-After': str(ADMISSION_RETRY_AFTER_SECONDS)})
+
+    @contextmanager
+    def admit(self, estimated_bytes, timeout=ADMISSION_QUEUE_TIMEOUT_SECONDS, control=None):
+        with self._condition:
+            if not self._fits(estimated_bytes):
+                if self.queued >= self.max_queued:
+                    raise self._rejection()
+                
+                print(f"⏳ Queued for admission ({estimated_bytes / 1024 ** 2:.0f}MB, "
+                      f"{self.reserved_bytes / 1024 ** 2:.0f}/{self.available_bytes / 1024 ** 2:.0f}MB in use)")
+                self.queued += 1
+                wait_until = None if timeout is None else time.time() + timeout
+                try:
+                    while not self._fits(estimated_bytes):
+                        if control is not None:
+                            control.raise_if_cancelled()
+                        wait = 0.5 if wait_until is None else min(0.5, wait_until - time.time())
+                        if wait <= 0:
+                            raise self._rejection()
+                        self._condition.wait(wait)
+                finally:
+                    self.queued -= 1
+            
+            self.reserved_bytes += estimated_bytes
+            self.running += 1
+            self.admitted += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self.reserved_bytes -= estimated_bytes
+                self.running -= 1
+                self._condition.notify_all()
+
+    def stats(self):
+        with self._condition:
+            return {
+                'budget_mb': round(self.budget_bytes / 1024 ** 2, 2),
+                'model_cache_mb': round(self.cache_bytes / 1024 ** 2, 2),
+                'available_mb': round(self.available_bytes / 1024 ** 2, 2),
+                'reserved_mb': round(self.reserved_bytes / 1024 ** 2, 2),
+                'running': self.running,
+                'queued': self.queued,
+                'admitted': self.admitted,
+                'rejected': self.rejected
+            }
+
+ADMISSION_CONTROLLER = AdmissionController(ASSESSMENT_MEMORY_BUDGET_MB * 1024 * 1024, ADMISSION_MAX_QUEUED,
+                                           cache_bytes=MODEL_CACHE.max_bytes)
+
+_model_content_hashes = {}
+_model_content_hashes_lock = threading.Lock()
+
+def model_content_hash(model_id, model_source='huggingface'):
+    """
+    Content fingerprint of a model's weights: sha256 of an uploaded file (memoized by
+    mtime/size) or the resolved Hugging Face commit hash from the local hub cache.
+    Returns None when the weights are not available locally yet.
+    """
+    if model_source == 'custom':
+        model_info = MODEL_REGISTRY.get(model_id)
+        if not model_info:
+            return None
+        filepath = os.path.join(MODELS_FOLDER, model_info['filename'])
+        if not os.path.exists(filepath):
+            return None
+        file_stat = os.stat(filepath)
+        memo_key = (filepath, file_stat.st_mtime_ns, file_stat.st_size)
+        with _model_content_hashes_lock:
+            if memo_key in _model_content_hashes:
+                return _model_content_hashes[memo_key]
+        digest = hashlib.sha256()
+        with open(filepath, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        content_hash = f"sha256:{digest.hexdigest()}"
+        with _model_content_hashes_lock:
+            _model_content_hashes[memo_key] = content_hash
+        return content_hash
+    
+    try:
+        from huggingface_hub.constants import HF_HUB_CACHE
+        ref_path = os.path.join(HF_HUB_CACHE, 'models--' + model_id.replace('/', '--'), 'refs', 'main')
+        with open(ref_path, 'r') as f:
+            return f"hf:{model_id}@{f.read().strip()}"
+    except Exception:
+        return None
+
+def library_versions():
+    """Versions of the libraries that determine assessment results."""
+    versions = {}
+    for package in ('torch', 'torchvision', 'transformers', 'numpy', 'pillow', 'tensorflow'):
+        try:
+            versions[package] = importlib_metadata.version(package)
+        except importlib_metadata.PackageNotFoundError:
+            versions[package] = None
+    return versions
+
+# Request parameters that only steer adaptive sampling, so non-adaptive runs share cache entries
+ADAPTIVE_ONLY_PARAMS = ('confidence', 'interval_method', 'max_interval_width', 'min_images')
+
+def assessment_cache_key(params, image_paths, allow_unresolved=False):
+    """
+    Content-addressed key for an assessment, or None if the model has no fingerprint yet.
+    With allow_unresolved, an unfingerprinted model is keyed by its source and id instead.
+    """
+    content_hash = model_content_hash(params['model_id'], params['model_source'])
+    if content_hash is None:
+        if not allow_unresolved:
+            return None
+        content_hash = f"unresolved:{params['model_source']}:{params['model_id']}"
+    
+    image_ids = []
+    for image_path in image_paths:
+        file_stat = os.stat(image_path)
+        image_ids.append([os.path.basename(image_path), file_stat.st_size, file_stat.st_mtime_ns])
+    
+    # Batch boundaries and the stopping rule only change results when adaptive sampling stops
+    # between batches; otherwise intervals are recomputed for each request on replay
+    attack_params = {key: value for key, value in params.items()
+                     if key not in ('model_id', 'model_source', 'batch_size', 'first_batch_size', 'use_cache', 'assessment_id')
+                     and (params.get('adaptive') or key not in ADAPTIVE_ONLY_PARAMS)}
+    if params.get('adaptive'):
+        attack_params['batch_size'] = params['batch_size']
+        # Streamed runs use a smaller first batch, which moves every later boundary
+        attack_params['first_batch_size'] = min(params.get('first_batch_size') or params['batch_size'], params['batch_size'])
+    
+    payload = {
+        'version': RESULT_CACHE_VERSION,
+        'model': content_hash,
+        'attack': attack_params,
+        'images': image_ids,
+        'libraries': library_versions()
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+class ResultCache:
+    """On-disk cache of assessment responses keyed by content hash, evicted oldest-first by size."""
+
+    def __init__(self, folder, max_bytes):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        return os.path.join(self.folder, f"{key}.json")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'r') as f:
+                response = json.load(f)
+            os.utime(path)  # refresh recency for eviction
+            self.hits += 1
+            return response
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+
+    def put(self, key, response):
+        try:
+            os.makedirs(self.folder, exist_ok=True)
+            tmp_path = f"{self._path(key)}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(response, f)
+            os.replace(tmp_path, self._path(key))
+            self._evict()
+        except Exception as e:
+            print(f"⚠️ Could not cache assessment result: {e}")
+
+    def _evict(self):
+        with self._lock:
+            entries = []
+            for name in os.listdir(self.folder):
+                if not name.endswith('.json'):
+                    continue
+                try:
+                    file_stat = os.stat(os.path.join(self.folder, name))
+                    entries.append((file_stat.st_mtime, file_stat.st_size, name))
+                except OSError:
+                    continue
+            total = sum(size for _, size, _ in entries)
+            for _, size, name in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(os.path.join(self.folder, name))
+                    total -= size
+                except OSError:
+                    pass
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'max_mb': round(self.max_bytes / 1024 ** 2, 2)}
+
+RESULT_CACHE = ResultCache(RESULT_CACHE_FOLDER, RESULT_CACHE_MAX_MB * 1024 * 1024)
+
+class InFlightAssessments:
+    """Registry of running assessments so identical concurrent requests share one computation."""
+
+    def __init__(self):
+        self.coalesced = 0
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def join(self, key):
+        """Return (flight, is_leader); the leader must call finish() once it has a result."""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                self.coalesced += 1
+                return flight, False
+            flight = {'done': threading.Event(), 'response': None, 'error': None}
+            self._flights[key] = flight
+            return flight, True
+
+    def finish(self, key, flight, response=None, error=None):
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        flight['response'] = response
+        flight['error'] = error
+        flight['done'].set()
+
+    def stats(self):
+        with self._lock:
+            return {'in_flight': len(self._flights), 'coalesced': self.coalesced}
+
+IN_FLIGHT_ASSESSMENTS = InFlightAssessments()
+
+def iter_threat_assessment(params, control=None):
+    """
+    Run a threat assessment, yielding ('start', info), ('image', image_result) for every
+    processed image and finally ('complete', response). Raises AssessmentError on failure
+    and AssessmentCancelled once `control` is cancelled.
+    """
+    control = control or AssessmentControl()
+    assessment_id = params.get('assessment_id')
+    model_id = params['model_id']
+    model_source = params['model_source']
+    
+    # Get random images from attack folder; they are streamed through in batches below so
+    # only the aggregates and per-image summaries grow with the sample size
+    image_paths = get_random_images(params['num_images'], params['seed'])
+    
+    if not image_paths:
+        raise AssessmentError({
+            'error': 'No images found',
+            'message': 'No images found in the backend/attack folder. Please add some images to test.',
+            'details': f'Expected folder: {ATTACK_IMAGES_FOLDER}'
+        })
+    
+    start_time = time.time()
+    
+    # The deadline counts from the start of the request, including the admission queue and model loading
+    deadline_ms = params.get('deadline_ms')
+    if deadline_ms:
+        control.deadline = start_time + deadline_ms / 1000
+    
+    print(f"📊 Starting threat assessment")
+    print(f"   Model: {model_id}")
+    print(f"   Model Source: {model_source}")
+    print(f"   Attack: {', '.join(a.upper() for a in params['attack_types'])}")
+    print(f"   Testing with {len(image_paths)} images")
+    
+    # Identical assessments (same weights, attack, parameters and images) are served from disk
+    cache_key = assessment_cache_key(params, image_paths) if params.get('use_cache', True) else None
+    cached_response = RESULT_CACHE.get(cache_key) if cache_key else None
+    if cached_response is not None:
+        print(f"♻️ Returning cached assessment result {cache_key[:12]}")
+        cached_response = restate_intervals(cached_response, params.get('confidence', 0.95), params.get('interval_method', 'wilson'))
+        yield from replay_assessment(dict(cached_response, cached=True, cache_key=cache_key, coalesced=False,
+                                          assessment_id=assessment_id))
+        return
+    
+    # Concurrent identical assessments attach to a single running computation
+    flight_key = cache_key or assessment_cache_key(params, image_paths, allow_unresolved=True)
+    flight, is_leader = IN_FLIGHT_ASSESSMENTS.join(flight_key)
+    if not is_leader:
+        print(f"🔗 Waiting for identical in-flight assessment {flight_key[:12]}")
+        while not flight['done'].wait(0.5):
+            control.raise_if_cancelled()
+        if flight['response'] is not None:
+            shared_response = restate_intervals(flight['response'], params.get('confidence', 0.95), params.get('interval_method', 'wilson'))
+            yield from replay_assessment(dict(shared_response, coalesced=True, assessment_id=assessment_id))
+            return
+        if flight['error'] is not None:
+            raise flight['error']
+        # The leading request was cancelled or interrupted without a result, so run it here
+    
+    response = None
+    error = None
+    try:
+        # Only work that will actually load a model and attack goes through admission
+        estimated_bytes = estimate_assessment_bytes(params)
+        admission_timeout = control.admission_timeout
+        remaining = control.remaining()
+        if remaining is not None:
+            if remaining <= 0:
+                raise AssessmentError({
+                    'error': 'Deadline exceeded',
+                    'message': f'The {deadline_ms}ms deadline passed before the assessment could start.'
+                }, 408)
+            # Never queue for admission past the deadline
+            admission_timeout = remaining if admission_timeout is None else min(admission_timeout, remaining)
+        with ADMISSION_CONTROLLER.admit(estimated_bytes, timeout=admission_timeout, control=control):
+            response = yield from iter_assessment_batches(params, image_paths, start_time, control)
+        
+        # The model is loaded now, so a first-time Hugging Face download has a fingerprint.
+        # Deadline-truncated results depend on timing, so they are never reused.
+        if params.get('use_cache', True) and not response['deadline_reached']:
+            cache_key = cache_key or assessment_cache_key(params, image_paths)
+            if cache_key:
+                RESULT_CACHE.put(cache_key, response)
+        response = dict(response, cached=False, cache_key=cache_key)
+    except AssessmentError as e:
+        # Waiting requests run the assessment themselves rather than inherit a cancellation
+        error = None if isinstance(e, AssessmentCancelled) else e
+        raise
+    finally:
+        if is_leader:
+            IN_FLIGHT_ASSESSMENTS.finish(flight_key, flight, response, error)
+    
+    yield 'complete', dict(response, coalesced=False, assessment_id=assessment_id)
+
+def restate_intervals(response, confidence, interval_method):
+    """Copy of a stored response with its success rate intervals at the requested confidence."""
+    num_images = response['num_images']
+    
+    def interval(success_rate):
+        return success_rate_interval(round(success_rate * num_images / 100), num_images, confidence, interval_method)
+    
+    attacks = [dict(attack, success_rate_interval=interval(attack['success_rate'])) for attack in response['attacks']]
+    robustness_curve = response.get('robustness_curve')
+    if robustness_curve:
+        robustness_curve = {
+            attack_name: [dict(point, success_rate_interval=interval(point['success_rate'])) for point in points]
+            for attack_name, points in robustness_curve.items()
+        }
+    return dict(response, attacks=attacks, robustness_curve=robustness_curve,
+                success_rate_interval=attacks[0]['success_rate_interval'])
+
+def replay_assessment(response):
+    """Yield the events of an already computed assessment response."""
+    yield 'start', {'total_images': len(response.get('image_results', [])), 'cached': response.get('cached', False)}
+    for image_result in response.get('image_results', []):
+        yield 'image', image_result
+    yield 'complete', response
+
+def summarize_attack(model_id, attack_type, totals, num_images, confidence=0.95, interval_method='wilson'):
+    """Aggregate one attack's running totals into its response summary."""
+    total_success = totals['success']
+    attack_name = attack_type.upper()
+    success_rate = (total_success / num_images) * 100
+    avg_original_acc = totals['original_acc'] / num_images
+    avg_adv_acc = totals['adv_acc'] / num_images
+    return {
+        'attack_type': attack_name,
+        'success_rate': success_rate,
+        'original_accuracy': avg_original_acc,
+        'adversarial_accuracy': avg_adv_acc,
+        'num_images': num_images,
+        'average_iterations': totals.get('iterations', 0) / num_images,
+        'success_rate_interval': success_rate_interval(total_success, num_images, confidence, interval_method),
+        'details': f"Successfully executed {attack_name} attack on model {model_id} using {num_images} test images. "
+                  f"Attack success rate: {success_rate:.1f}%. "
+                  f"Average original accuracy: {avg_original_acc:.2f}%, "
+                  f"Average adversarial accuracy: {avg_adv_acc:.2f}%. "
+                  f"The attack successfully fooled the model in {total_success} out of {num_images} cases."
+    }
+
+def iter_assessment_batches(params, image_paths, start_time, control):
+    """
+    Load the model and attack the selected images batch by batch, yielding ('start', info)
+    and ('image', image_result) events. Returns the aggregate response.
+    """
+    model_id = params['model_id']
+    attack_types = params.get('attack_types') or [params['attack_type']]
+    model_source = params['model_source']
+    batch_size = params['batch_size']
+    
+    # Load model and processor based on source
+    print(f"🔄 Loading model...")
+    model, processor = load_assessment_model(model_id, model_source)
+    label_map = getattr(getattr(model, 'config', None), 'id2label', {}) or {}
+    
+    yield 'start', {'total_images': len(image_paths)}
+    
+    # control.deadline is already set from deadline_ms by iter_threat_assessment
+    deadline_ms = params.get('deadline_ms')
+    
+    # Initialize attack handler
+    attacker = AdversarialAttacks(model, processor, micro_batch_size=batch_size,
+                                  early_exit=params.get('early_exit', False), control=control)
+    
+    # Process images in stacked batches, keeping running totals for every attack
+    stop_reason = None
+    totals = {attack_type: {'success': 0, 'original_acc': 0, 'adv_acc': 0, 'iterations': 0} for attack_type in attack_types}
+    image_results = []
+    attempted_images = 0
+    attack_seconds = 0.0
+    
+    # Robustness curve totals for each swept attack and epsilon
+    epsilons = params.get('epsilons') or []
+    sweep_types = [attack_type for attack_type in attack_types if epsilons and attack_type in SWEEP_ATTACKS]
+    curve_totals = {attack_type: [{'success': 0, 'adv_acc': 0, 'partial': 0} for _ in epsilons] for attack_type in sweep_types}
+    
+    # Streaming clients get a single-image first batch so the first result arrives quickly.
+    # With a deadline, that one-image probe also measures the per-image cost that sizes later batches.
+    first_batch_size = min(params.get('first_batch_size') or batch_size, batch_size)
+    if deadline_ms:
+        first_batch_size = 1
+    batch_starts = [0] + list(range(first_batch_size, len(image_paths), batch_size))
+    batch_ends = batch_starts[1:] + [len(image_paths)]
+    
+    path_batches = [image_paths[batch_start:batch_end] for batch_start, batch_end in zip(batch_starts, batch_ends)]
+    
+    for batch_start, batch_paths, batch_future in zip(batch_starts, path_batches, iter_prefetched_batches(processor, path_batches)):
+        control.raise_if_cancelled()
         
-        # Get number of classes from model
-        num_classes = min(num_classes, logits.shape[1])
+        # Anytime mode: stop at the deadline, always finishing at least the first batch
+        if image_results and control.should_stop():
+            stop_reason = 'deadline'
+            print(f"   ⏱️  Deadline reached after {len(image_results)} images")
+            break
         
-        iteration = 0
-        current_class = original_class
+        print(f"\n🖼️  Processing images {batch_start + 1}-{batch_start + len(batch_paths)}/{len(image_paths)}")
         
-        while iteration < max_iter and current_class == original_class:
-            perturbed_image.requires_grad = True
-            
-            outputs = self.model(perturbed_image)
-            logits = outputs.logits
-            
-            # Get top classes
-            _, top_classes = torch.topk(logits[0], num_classes)
-            top_classes = top_classes.cpu().numpy()
-            
-            # Calculate gradients
-            self.model.zero_grad()
-            
-            # Get gradient for original class
-            logits[0, original_class].backward(retain_graph=True)
-            grad_orig = perturbed_image.grad.data.clone()
+        try:
+            image_batch, image_names = batch_future.result()
+            attempted_images = batch_start + len(batch_paths)
+            if not image_names:
+                continue
             
-            pert = float('inf')
-            w = None
+            # Shrink the batch to the number of images the remaining time is expected to fit
+            remaining = control.remaining()
+            if remaining is not None and image_results and attack_seconds > 0:
+                fitting_images = int(remaining / (attack_seconds / len(image_results)))
+                if fitting_images < 1:
+                    attempted_images = batch_start
+                    stop_reason = 'deadline'
+                    print(f"   ⏱️  No time left for another image after {len(image_results)} images")
+                    break
+                if fitting_images < len(image_names):
+                    image_batch, image_names = image_batch[:fitting_images], image_names[:fitting_images]
+                    attempted_images = batch_start + fitting_images
+                    stop_reason = 'deadline'
             
-            for k in top_classes:
-                if k == original_class:
-                    continue
-                
-                self.model.zero_grad()
-                perturbed_image.grad.zero_()
-                logits[0, k].backward(retain_graph=True)
-                grad_k = perturbed_image.grad.data.clone()
+            batch_attack_start = time.time()
+            # Run every attack against the same preprocessed batch and clean predictions
+            print(f"   ⚔️  Running {', '.join(a.upper() for a in attack_types)} on {len(image_names)} images...")
+            if sweep_types:
+                print(f"   📈 Sweeping {', '.join(a.upper() for a in sweep_types)} over {len(epsilons)} epsilons...")
+            eval_results = attacker.attack_and_evaluate_all(attack_types, image_batch, sweep_epsilons=epsilons if sweep_types else None)
+            sweep_results = attacker.last_sweep_results
+            attack_seconds += time.time() - batch_attack_start
+        except AssessmentCancelled:
+            raise
+        except Exception as e:
+            print(f"   ❌ Error processing batch: {str(e)}")
+            continue
+        
+        # Attacks cut short by a cancellation are discarded rather than reported
+        control.raise_if_cancelled()
+        
+        for attack_type, epsilon_results in sweep_results.items():
+            for point_totals, point_results in zip(curve_totals[attack_type], epsilon_results):
+                point_totals['success'] += sum(int(result['success']) for result in point_results)
+                point_totals['adv_acc'] += sum(result['adversarial_confidence'] * 100 for result in point_results)
+                point_totals['partial'] += sum(int(result['partial']) for result in point_results)
+        
+        for index, image_name in enumerate(image_names):
+            attack_results = {}
+            for attack_type in attack_types:
+                eval_result = eval_results[attack_type][index]
                 
-                # Calculate w_k and f_k
-                w_k = grad_k - grad_orig
-                f_k = (logits[0, k] - logits[0, original_class]).item()
+                # Track results
+                totals[attack_type]['success'] += int(eval_result['success'])
+                totals[attack_type]['original_acc'] += eval_result['original_confidence'] * 100
+                totals[attack_type]['adv_acc'] += eval_result['adversarial_confidence'] * 100
+                totals[attack_type]['iterations'] += eval_result['iterations']
                 
-                # Calculate perturbation
-                pert_k = abs(f_k) / (torch.norm(w_k.flatten()) + 1e-8)
+                attack_results[attack_type] = {
+                    'success': eval_result['success'],
+                    'original_pred': eval_result['original_pred'],
+                    'original_label': resolve_prediction_label(label_map, eval_result['original_pred']),
+                    'adversarial_pred': eval_result['adversarial_pred'],
+                    'adversarial_label': resolve_prediction_label(label_map, eval_result['adversarial_pred']),
+                    'original_confidence': eval_result['original_confidence'] * 100,
+                    'adversarial_confidence': eval_result['adversarial_confidence'] * 100,
+                    'iterations': eval_result['iterations'],
+                    'partial': eval_result['partial']
+                }
                 
-                if pert_k < pert:
-                    pert = pert_k
-                    w = w_k
-            
-            # Update perturbed image
-            if w is not None:
-                with torch.no_grad():
-                    r = (pert + 1e-4) * w / (torch.norm(w.flatten()) + 1e-8)
-                    perturbed_image = perturbed_image + (1 + overshoot) * r
-                    perturbed_image = torch.clamp(perturbed_image, 0, 1)
-            
-            perturbed_image = perturbed_image.detach()
+                print(f"   {image_name} [{attack_type.upper()}]: success={eval_result['success']} "
+                      f"class {eval_result['original_pred']} ({eval_result['original_confidence']*100:.2f}%) -> "
+                      f"class {eval_result['adversarial_pred']} ({eval_result['adversarial_confidence']*100:.2f}%)")
             
-            # Check new prediction
-            with torch.no_grad():
-                outputs = self.model(perturbed_image)
-                logits = outputs.logits
-                current_class = logits.argmax(dim=1).item()
-            
-            iteration += 1
+            # Top-level fields describe the first attack; the rest are listed per attack
+            image_result = dict({'image_name': image_name}, **attack_results[attack_types[0]])
+            image_result['finished'] = not any(result['partial'] for result in attack_results.values())
+            if len(attack_types) > 1:
+                image_result['attacks'] = attack_results
+            image_results.append(image_result)
+            yield 'image', image_result
         
-        return perturbed_image
+        if stop_reason == 'deadline':
+            print(f"   ⏱️  Deadline reached after {len(image_results)} images")
+            break
+        
+        # Adaptive sampling: stop once every attack's interval settles the width or the severity bucket
+        if params.get('adaptive') and image_results and len(image_results) >= params['min_images']:
+            stop_reasons = []
+            for attack_type in attack_types:
+                interval = success_rate_interval(totals[attack_type]['success'], len(image_results), params['confidence'], params['interval_method'])
+                stop_reasons.append(adaptive_stop_reason(interval, params['max_interval_width']))
+            if all(stop_reasons):
+                stop_reason = stop_reasons[0]
+                print(f"   🛑 Stopping early after {len(image_results)} images ({stop_reason})")
+                break
     
-    def evaluate_attack(self, original_image, adversarial_image):
-        """
-        Evaluate the success of the attack
-        """
-        with torch.no_grad():
-            # Original prediction
-            original_outputs = self.model(original_image.to(device))
-            original_logits = original_outputs.logits
-            original_pred = original_logits.argmax(dim=1).item()
-            original_confidence = F.softmax(original_logits, dim=1).max().item()
-            
-            # Adversarial prediction
-            adv_outputs = self.model(adversarial_image.to(device))
-            adv_logits = adv_outputs.logits
-            adv_pred = adv_logits.argmax(dim=1).item()
-            adv_confidence = F.softmax(adv_logits, dim=1).max().item()
-            
-            # Attack success
-            success = original_pred != adv_pred
-            
-            return {
-                'success': success,
-                'original_pred': original_pred,
-                'original_confidence': original_confidence,
-                'adversarial_pred': adv_pred,
-                'adversarial_confidence': adv_confidence
+    execution_time = time.time() - start_time
+    
+    # Calculate aggregate metrics
+    num_images = len(image_results)
+    if num_images == 0:
+        raise AssessmentError({'error': 'No images were successfully processed'}, 500)
+    
+    attacks = [
+        summarize_attack(model_id, attack_type, totals[attack_type], num_images,
+                         params.get('confidence', 0.95), params.get('interval_method', 'wilson'))
+        for attack_type in attack_types
+    ]
+    
+    robustness_curve = {}
+    for attack_type in sweep_types:
+        robustness_curve[attack_type.upper()] = [
+            {
+                'epsilon': epsilon,
+                'success_rate': point_totals['success'] / num_images * 100,
+                'adversarial_accuracy': point_totals['adv_acc'] / num_images,
+                'success_rate_interval': success_rate_interval(point_totals['success'], num_images,
+                                                              params.get('confidence', 0.95), params.get('interval_method', 'wilson')),
+                'partial': point_totals['partial'] > 0,
+                'partial_images': point_totals['partial']
             }
+            for epsilon, point_totals in zip(epsilons, curve_totals[attack_type])
+        ]
+    
+    print(f"\n" + "=" * 60)
+    print(f"✅ Attack completed in {execution_time:.2f}s")
+    print(f"   Images processed: {num_images} ({num_images / max(execution_time, 1e-6):.2f} images/sec, batch size {batch_size})")
+    for attack in attacks:
+        print(f"   {attack['attack_type']}: success rate {attack['success_rate']:.1f}%, "
+              f"avg original accuracy {attack['original_accuracy']:.2f}%, "
+              f"avg adversarial accuracy {attack['adversarial_accuracy']:.2f}%")
+    print("=" * 60)
+    print()
+    
+    # Prepare response (top-level metrics are those of the first attack)
+    primary = attacks[0]
+    response = {
+        'attack_type': primary['attack_type'],
+        'attack_types': [attack['attack_type'] for attack in attacks],
+        'success_rate': primary['success_rate'],
+        'original_accuracy': primary['original_accuracy'],
+        'adversarial_accuracy': primary['adversarial_accuracy'],
+        'execution_time': execution_time,
+        'num_images': num_images,
+        'num_images_requested': 'all' if params['num_images'] is None else params['num_images'],
+        'seed': params['seed'],
+        'images_used': num_images,
+        'adaptive': bool(params.get('adaptive')),
+        'stopped_early': stop_reason is not None,
+        'stop_reason': stop_reason,
+        'success_rate_interval': primary['success_rate_interval'],
+        'batch_size': batch_size,
+        'early_exit': bool(params.get('early_exit')),
+        'average_iterations': primary['average_iterations'],
+        'deadline_ms': deadline_ms,
+        'deadline_reached': stop_reason == 'deadline' or any(not result['finished'] for result in image_results),
+        'images_finished': sum(1 for result in image_results if result['finished']),
+        'skipped_images': [os.path.basename(path) for path in image_paths[attempted_images:]],
+        'throughput': {
+            'images_per_second': num_images / max(execution_time, 1e-6),
+            'forward_samples_per_second': attacker.pass_counts['forward_samples'] / max(execution_time, 1e-6)
+        },
+        'pass_counts': attacker.pass_counts,
+        'attacks': attacks,
+        'epsilons': epsilons or None,
+        'robustness_curve': robustness_curve or None,
+        'image_results': image_results,
+        'details': ' '.join(attack['details'] for attack in attacks)
+    }
+    return response
 
-@app.route('/api/threat-assessment', methods=['POST'])
-@require_clerk_auth
-def threat_assessment():
-    try:
-        ensure_ml_dependencies()
-        # Get parameters
-        data = request.get_json()
-        model_id = data.get('model_id')
-        attack_type = data.get('attack_type', 'fgsm')
-        model_source = data.get('model_source', 'huggingface')  # 'huggingface' or 'custom'
-        
+def run_threat_assessment(params, control=None):
+    """Run a threat assessment to completion and return the response payload."""
+    response = None
+    for event, payload in iter_threat_assessment(params, control):
+        if event == 'complete':
+            response = payload
+    return response
+
+def parse_comparison_request(data):
+    """Validate a multi-model comparison request; shared options follow parse_assessment_request."""
+    data = data or {}
+    models = data.get('models') or data.get('model_ids')
+    if not isinstance(models, list) or not models:
+        raise AssessmentError({'error': 'Missing models', 'message': 'Provide a list of models to compare.'})
+    
+    default_source = data.get('model_source', 'huggingface')
+    model_specs = []
+    for model in models:
+        if isinstance(model, dict):
+            model_id, model_source = model.get('model_id'), model.get('model_source', default_source)
+        else:
+            model_id, model_source = model, default_source
         if not model_id:
-            return jsonify({'error': 'Missing model_id'}), 400
-        
-        # Get random images from attack folder
-        image_paths = get_random_images(10)
-        
-        if not image_paths:
-            return jsonify({
-                'error': 'No images found',
-                'message': 'No images found in the backend/attack folder. Please add some images to test.',
-                'details': f'Expected folder: {ATTACK_IMAGES_FOLDER}'
-            }), 400
+            raise AssessmentError({'error': 'Missing model_id'})
+        if (model_id, model_source) not in model_specs:
+            model_specs.append((model_id, model_source))
+    
+    if len(model_specs) > COMPARISON_MAX_MODELS:
+        raise AssessmentError({
+            'error': 'Too many models',
+            'message': f'At most {COMPARISON_MAX_MODELS} models can be compared at once.'
+        })
+    
+    unsupported = [option for option in ('epsilons', 'deadline_ms') if data.get(option) is not None]
+    if unsupported:
+        raise AssessmentError({
+            'error': 'Unsupported option',
+            'message': f'{", ".join(unsupported)} cannot be used with model comparisons.'
+        })
+    
+    params = parse_assessment_request(dict(data, model_id=model_specs[0][0], model_source=model_specs[0][1], adaptive=False))
+    params['models'] = [{'model_id': model_id, 'model_source': model_source} for model_id, model_source in model_specs]
+    return params
+
+def processor_config_key(processor):
+    """Key identifying processors that turn an image into identical pixel values."""
+    config = describe_processor(processor)
+    if config is None and hasattr(processor, 'to_dict'):
+        config = processor.to_dict()
+    if config is None:
+        return f"processor-{id(processor)}"
+    return hashlib.sha1(json.dumps(config, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+def run_model_comparison(params):
+    """
+    Attack several models with the same images: the images are selected once and decoded
+    once per distinct processor configuration into the uint8 image cache, then normalized
+    one batch at a time. The models are run one at a time so only one is resident outside
+    MODEL_CACHE. Returns a side-by-side comparison table.
+    """
+    ensure_inference_dependencies()
+    attack_types = params['attack_types']
+    batch_size = params['batch_size']
+    
+    image_paths = get_random_images(params['num_images'], params['seed'])
+    if not image_paths:
+        raise AssessmentError({
+            'error': 'No images found',
+            'message': 'No images found in the backend/attack folder. Please add some images to test.',
+            'details': f'Expected folder: {ATTACK_IMAGES_FOLDER}'
+        })
+    path_batches = [image_paths[start:start + batch_size] for start in range(0, len(image_paths), batch_size)]
+    
+    print(f"📊 Starting model comparison")
+    print(f"   Models: {', '.join(model['model_id'] for model in params['models'])}")
+    print(f"   Attack: {', '.join(a.upper() for a in attack_types)}")
+    print(f"   Testing with {len(image_paths)} images")
+    
+    start_time = time.time()
+    processor_configs = set()
+    rows = []
+    results = []
+    
+    for model_spec in params['models']:
+        model_id = model_spec['model_id']
+        model_start = time.time()
+        try:
+            print(f"🔄 Loading model {model_id}...")
+            model, processor = load_assessment_model(model_id, model_spec['model_source'])
+        except ModelLoadError as e:
+            results.append(dict(model_spec, error=e.payload))
+            rows.append(dict(model_spec, error=e.payload.get('message') or e.payload.get('error')))
+            continue
         
-        start_time = time.time()
+        # Models sharing a processor configuration reuse the same decoded uint8 images
+        config_key = processor_config_key(processor)
+        processor_configs.add(config_key)
         
-        print(f"📊 Starting threat assessment")
-        print(f"   Model: {model_id}")
-        print(f"   Model Source: {model_source}")
-        print(f"   Attack: {attack_type.upper()}")
-        print(f"   Testing with {len(image_paths)} images")
+        totals = {attack_type: {'success': 0, 'original_acc': 0, 'adv_acc': 0, 'iterations': 0} for attack_type in attack_types}
+        num_images = 0
+        try:
+            attacker = AdversarialAttacks(model, processor, micro_batch_size=batch_size, early_exit=params.get('early_exit', False))
+            for batch_future in iter_prefetched_batches(processor, path_batches):
+                image_batch, image_names = batch_future.result()
+                if not image_names:
+                    continue
+                print(f"   ⚔️  Running {', '.join(a.upper() for a in attack_types)} on {len(image_names)} images...")
+                eval_results = attacker.attack_and_evaluate_all(attack_types, image_batch)
+                num_images += len(image_names)
+                for attack_type in attack_types:
+                    for eval_result in eval_results[attack_type]:
+                        totals[attack_type]['success'] += int(eval_result['success'])
+                        totals[attack_type]['original_acc'] += eval_result['original_confidence'] * 100
+                        totals[attack_type]['adv_acc'] += eval_result['adversarial_confidence'] * 100
+                        totals[attack_type]['iterations'] += eval_result['iterations']
+            if num_images == 0:
+                raise Exception('No images were successfully processed')
+        except Exception as e:
+            # One model failing (e.g. a Keras model without input gradients) does not abort the comparison
+            print(f"❌ Error attacking model {model_id}: {str(e)}")
+            error = {'error': 'Attack failed', 'message': str(e)}
+            results.append(dict(model_spec, error=error))
+            rows.append(dict(model_spec, error=error['message']))
+            continue
+        finally:
+            # Drop this model before loading the next one
+            model = attacker = None
         
-        # Load model and processor based on source
-        print(f"🔄 Loading model...")
+        attacks = [
+            summarize_attack(model_id, attack_type, totals[attack_type], num_images,
+                             params.get('confidence', 0.95), params.get('interval_method', 'wilson'))
+            for attack_type in attack_types
+        ]
+        execution_time = time.time() - model_start
+        results.append(dict(model_spec, attacks=attacks, num_images=num_images,
+                            execution_time=execution_time, processor_config=config_key))
+        for attack in attacks:
+            rows.append(dict(model_spec,
+                             attack_type=attack['attack_type'],
+                             success_rate=attack['success_rate'],
+                             original_accuracy=attack['original_accuracy'],
+                             adversarial_accuracy=attack['adversarial_accuracy'],
+                             success_rate_interval=attack['success_rate_interval'],
+                             num_images=num_images,
+                             execution_time=execution_time))
+        print(f"✅ {model_id}: " + ', '.join(f"{a['attack_type']} {a['success_rate']:.1f}%" for a in attacks))
+    
+    return {
+        'attack_types': [a.upper() for a in attack_types],
+        'seed': params['seed'],
+        'num_images_requested': 'all' if params['num_images'] is None else params['num_images'],
+        'images': [os.path.basename(path) for path in image_paths],
+        'batch_size': batch_size,
+        'processor_configs': len(processor_configs),
+        'execution_time': time.time() - start_time,
+        'table': rows,
+        'models': results
+    }
+
+class AssessmentJobManager:
+    """
+    Bounded background worker pool for queued threat assessments.
+    
+    Every state change is written to JOBS_FOLDER, so with several server workers a
+    poll or cancel request can reach any of them. Cancelling a job owned by another
+    worker leaves a .cancel marker that the owning worker picks up.
+    """
+
+    def __init__(self, max_workers, max_pending, jobs_folder, retention=ASSESSMENT_JOB_RETENTION):
+        self.max_pending = max_pending
+        self.jobs_folder = jobs_folder
+        self.retention = retention
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='assessment-job')
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _job_path(self, job_id):
+        return os.path.join(self.jobs_folder, f"{job_id}.json")
+
+    def _cancel_path(self, job_id):
+        return os.path.join(self.jobs_folder, f"{job_id}.cancel")
+
+    def submit(self, params, clerk_claims):
+        with self._lock:
+            pending = sum(1 for job in self._jobs.values() if job['status'] in ('queued', 'running'))
+            if pending >= self.max_pending:
+                raise AssessmentError({
+                    'error': 'Too many queued assessments',
+                    'message': 'The assessment queue is full. Please try again shortly.'
+                }, 429)
+
+            job = {
+                'id': uuid.uuid4().hex,
+                'user_id': (clerk_claims or {}).get('sub'),
+                'status': 'queued',
+                'model_id': params['model_id'],
+                'model_source': params['model_source'],
+                'attack_type': params['attack_type'].upper(),
+                'attack_types': [a.upper() for a in params['attack_types']],
+                'created_at': datetime.utcnow().isoformat() + 'Z',
+                'started_at': None,
+                'finished_at': None,
+                'progress': {'processed_images': 0, 'total_images': None},
+                'image_results': [],
+                'result': None,
+                'error': None
+            }
+            self._jobs[job['id']] = job
+            self._prune_locked()
+        self._persist(job)
+
+        # The job id doubles as the assessment id used for cancellation
+        self._executor.submit(self._run, job, dict(params, assessment_id=job['id']), clerk_claims)
+        return dict(job)
+
+    def _prune_locked(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job['status'] in ('completed', 'failed', 'cancelled')]
+        for job_id in finished[:max(0, len(self._jobs) - self.retention)]:
+            del self._jobs[job_id]
+
+    def _prune_files(self):
+        """Keep only the most recently updated job files, like _prune_locked does in memory."""
         try:
-            if model_source == 'custom':
-                # Load custom model
-                metadata = load_models_metadata()
-                if model_id not in metadata:
-                    return jsonify({
-                        'error': 'Model not found',
-                        'message': f'Custom model "{model_id}" not found. Please upload the model first.'
-                    }), 404
-                
-                model_info = metadata[model_id]
-                filepath = os.path.join(MODELS_FOLDER, model_info['filename'])
-                
-                if not os.path.exists(filepath):
-                    return jsonify({
-                        'error': 'Model file not found',
-                        'message': f'Model file for "{model_info["name"]}" not found on disk.'
-                    }), 404
-                
-                # Load the custom model
-                file_ext = model_info['file_type']
-                if file_ext in ['pt', 'pth']:
-                    model = load_custom_pytorch_model(filepath, model_info['num_classes'], model_info['input_size'])
-                elif file_ext in ['h5', 'keras']:
-                    model = load_custom_keras_model(filepath)
-                else:
-                    return jsonify({
-                        'error': 'Unsupported model format',
-                        'message': f'Model format "{file_ext}" is not supported.'
-                    }), 400
-                
-                # Create default processor for custom models
-                processor = create_default_processor(model_info['input_size'])
-                print(f"✅ Custom model loaded successfully: {model_info['name']}")
-                
-            else:
-                # Load from Hugging Face
-                processor = AutoImageProcessor.from_pretrained(model_id)
-                model = AutoModelForImageClassification.from_pretrained(model_id)
-                print(f"✅ Hugging Face model loaded successfully")
-                
-            label_map = getattr(getattr(model, 'config', None), 'id2label', {}) or {}
+            entries = []
+            for name in os.listdir(self.jobs_folder):
+                if name.endswith('.json'):
+                    path = os.path.join(self.jobs_folder, name)
+                    entries.append((os.path.getmtime(path), path))
+            for _, path in sorted(entries, reverse=True)[self.retention:]:
+                os.remove(path)
+                cancel_path = path[:-len('.json')] + '.cancel'
+                if os.path.exists(cancel_path):
+                    os.remove(cancel_path)
         except OSError as e:
-            error_msg = str(e)
-            if "does not appear to have a file named preprocessor_config.json" in error_msg or "does not appear to have a file named config.json" in error_msg:
-                return jsonify({
-                    'error': 'Invalid model type',
-                    'message': f'The model "{model_id}" is not an image classification model. Please use a vision model like:\n• google/vit-base-patch16-224\n• microsoft/resnet-50\n• facebook/convnext-tiny-224',
-                    'details': 'This tool only supports image classification models from Hugging Face Hub.'
-                }), 400
+            print(f"⚠️ Could not prune assessment jobs: {e}")
+
+    def cancel_queued(self, job_id, user_id):
+        """Cancel a job that has not started yet; returns False if there is none."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job['user_id'] != user_id or job['status'] != 'queued':
+                return False
+            job['status'] = 'cancelled'
+            job['finished_at'] = datetime.utcnow().isoformat() + 'Z'
+        self._persist(job)
+        return True
+
+    def cancel_elsewhere(self, job_id, user_id):
+        """
+        Ask the worker that owns a queued or running job to cancel it; returns False if
+        no such job exists on disk.
+        """
+        with self._lock:
+            if job_id in self._jobs:
+                return False
+        job = self.get(job_id)
+        if job is None or job.get('user_id') != user_id or job['status'] not in ('queued', 'running'):
+            return False
+        try:
+            with open(self._cancel_path(job_id), 'w') as f:
+                f.write(datetime.utcnow().isoformat() + 'Z')
+        except OSError as e:
+            print(f"⚠️ Could not request cancellation of assessment job {job_id}: {e}")
+            return False
+        return True
+
+    def _watch_cancel(self, job_id, control, done):
+        while not done.wait(ASSESSMENT_JOB_CANCEL_POLL_SECONDS):
+            if os.path.exists(self._cancel_path(job_id)):
+                control.cancel()
+                return
+
+    def _run(self, job, params, clerk_claims):
+        with self._lock:
+            if job['status'] == 'cancelled':
+                return
+            if os.path.exists(self._cancel_path(job['id'])):
+                job['status'] = 'cancelled'
+                job['finished_at'] = datetime.utcnow().isoformat() + 'Z'
             else:
-                return jsonify({
-                    'error': 'Model loading failed',
-                    'message': f'Failed to load model "{model_id}". Please verify the model ID exists on Hugging Face Hub.',
-                    'details': error_msg
-                }), 400
-        except Exception as e:
-            return jsonify({
-                'error': 'Model loading failed',
-                'message': f'An unexpected error occurred while loading the model.',
-                'details': str(e)
-            }), 400
-        
-        # Initialize attack handler
-        attacker = AdversarialAttacks(model, processor)
+                job['status'] = 'running'
+                job['started_at'] = datetime.utcnow().isoformat() + 'Z'
+        self._persist(job)
+        if job['status'] == 'cancelled':
+            return
         
-        # Process multiple images
-        total_success = 0
-        total_original_acc = 0
-        total_adv_acc = 0
-        image_results = []
+        done = threading.Event()
+        last_persisted = time.time()
+        try:
+            with RUNNING_ASSESSMENTS.track(job['id'], job['user_id']) as control:
+                # Queued jobs wait for memory instead of being rejected
+                control.admission_timeout = None
+                threading.Thread(target=self._watch_cancel, args=(job['id'], control, done), daemon=True).start()
+                for event, payload in iter_threat_assessment(params, control):
+                    with self._lock:
+                        if event == 'start':
+                            job['progress']['total_images'] = payload['total_images']
+                        elif event == 'image':
+                            job['image_results'].append(payload)
+                            job['progress']['processed_images'] += 1
+                        elif event == 'complete':
+                            job['result'] = payload
+                    if event == 'start' or time.time() - last_persisted >= ASSESSMENT_JOB_PERSIST_SECONDS:
+                        self._persist(job)
+                        last_persisted = time.time()
+
+            persist_assessment_history(clerk_claims, params['model_id'], job['result'])
+            job['status'] = 'completed'
+        except AssessmentCancelled as e:
+            print(f"🛑 Assessment job {job['id']} cancelled")
+            job['error'] = e.payload
+            job['status'] = 'cancelled'
+        except AssessmentError as e:
+            job['error'] = e.payload
+            job['status'] = 'failed'
+        except Exception as e:
+            print(f"❌ Assessment job {job['id']} failed: {str(e)}")
+            import traceback
+            traceback.print_exc()
+            job['error'] = {'error': str(e)}
+            job['status'] = 'failed'
+        finally:
+            done.set()
+            job['finished_at'] = datetime.utcnow().isoformat() + 'Z'
+            self._persist(job)
+            if os.path.exists(self._cancel_path(job['id'])):
+                os.remove(self._cancel_path(job['id']))
+            self._prune_files()
+
+    def _persist(self, job):
+        """Write the job's current state to disk so other workers and later requests can read it."""
+        with self._lock:
+            snapshot = dict(job, progress=dict(job['progress']), image_results=list(job['image_results']))
+        tmp_path = f"{self._job_path(job['id'])}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(self.jobs_folder, exist_ok=True)
+            with open(tmp_path, 'w') as f:
+                json.dump(snapshot, f)
+            os.replace(tmp_path, self._job_path(job['id']))
+        except Exception as e:
+            print(f"⚠️ Could not persist assessment job {job['id']}: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                return dict(job, progress=dict(job['progress']), image_results=list(job['image_results']))
+
+        if not re.fullmatch(r'[0-9a-f]{32}', job_id or ''):
+            return None
+        job_path = self._job_path(job_id)
+        if not os.path.exists(job_path):
+            return None
+        try:
+            with open(job_path, 'r') as f:
+                return json.load(f)
+        except Exception:
+            return None
+
+ASSESSMENT_JOBS = AssessmentJobManager(ASSESSMENT_JOB_WORKERS, ASSESSMENT_JOB_MAX_PENDING, JOBS_FOLDER)
+
+def get_user_job(job_id):
+    """Return an assessment job if it belongs to the authenticated user."""
+    job = ASSESSMENT_JOBS.get(job_id)
+    user_id = (getattr(request, 'clerk_claims', {}) or {}).get('sub')
+    if job is None or job.get('user_id') != user_id:
+        return None
+    return job
+
+@app.route('/api/threat-assessment', methods=['POST'])
+@require_clerk_auth
+def threat_assessment():
+    try:
+        params = parse_assessment_request(request.get_json())
+        clerk_claims = getattr(request, 'clerk_claims', None)
+        with RUNNING_ASSESSMENTS.track(params['assessment_id'], (clerk_claims or {}).get('sub')) as control:
+            response = run_threat_assessment(params, control)
+
+        persist_assessment_history(clerk_claims, params['model_id'], response)
         
-        for idx, image_path in enumerate(image_paths, 1):
-            try:
-                print(f"\n🖼️  Processing image {idx}/{len(image_paths)}: {os.path.basename(image_path)}")
-                
-                # Load and process image
-                image = Image.open(image_path).convert('RGB')
-                inputs = processor(images=image, return_tensors="pt", padding=True)
-                image_tensor = inputs['pixel_values']
-                
-                # Get original prediction
-                with torch.no_grad():
-                    original_outputs = model(image_tensor.to(device))
-                    original_accuracy = F.softmax(original_outputs.logits, dim=1).max().item() * 100
+        return jsonify(response)
+    
+    except AssessmentError as e:
+        return jsonify(e.payload), e.status_code, e.headers
+    except Exception as e:
+        print(f"❌ Error: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return jsonify({'error': str(e)}), 500
+
+def format_sse(event, payload):
+    """Format one Server-Sent Events message."""
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+@app.route('/api/threat-assessment/stream', methods=['POST'])
+@require_clerk_auth
+def stream_threat_assessment():
+    """Run a threat assessment and stream each per-image result as a Server-Sent Event"""
+    try:
+        params = parse_assessment_request(request.get_json())
+        params['first_batch_size'] = 1
+    except AssessmentError as e:
+        return jsonify(e.payload), e.status_code, e.headers
+    
+    clerk_claims = getattr(request, 'clerk_claims', None)
+    assessment_id = params['assessment_id']
+    try:
+        control = RUNNING_ASSESSMENTS.register(assessment_id, (clerk_claims or {}).get('sub'))
+    except AssessmentError as e:
+        return jsonify(e.payload), e.status_code, e.headers
+    
+    # The assessment runs in a worker thread so the response can send heartbeats; a
+    # heartbeat that cannot be written means the client is gone and the work is cancelled
+    events = queue.Queue()
+    
+    def run():
+        try:
+            for event in iter_threat_assessment(params, control):
+                events.put(event)
+        except Exception as e:
+            events.put(('error', e))
+        finally:
+            RUNNING_ASSESSMENTS.release(assessment_id, control)
+            events.put(('done', None))
+    
+    worker = threading.Thread(target=run, name=f"assessment-stream-{assessment_id}", daemon=True)
+    worker.start()
+    
+    def generate():
+        try:
+            while True:
+                try:
+                    event, payload = events.get(timeout=SSE_HEARTBEAT_SECONDS)
+                except queue.Empty:
+                    yield ": heartbeat\n\n"
+                    continue
                 
-                # Run attack
-                print(f"   ⚔️  Running {attack_type.upper()} attack...")
-                if attack_type == 'fgsm':
-                    adversarial_image = attacker.fgsm_attack(image_tensor)
-                elif attack_type == 'pgd':
-                    adversarial_image = attacker.pgd_attack(image_tensor)
-                elif attack_type == 'deepfool':
-                    adversarial_image = attacker.deepfool_attack(image_tensor)
+                if event == 'done':
+                    break
+                elif event == 'start':
+                    yield format_sse('start', dict(payload, assessment_id=assessment_id))
+                elif event == 'image':
+                    yield format_sse('image_result', payload)
+                elif event == 'complete':
+                    persist_assessment_history(clerk_claims, params['model_id'], payload)
+                    yield format_sse('complete', payload)
+                elif isinstance(payload, AssessmentError):
+                    yield format_sse('error', dict(payload.payload, status_code=payload.status_code))
                 else:
-                    return jsonify({'error': 'Invalid attack type'}), 400
-                
-                # Evaluate attack
-                eval_results = attacker.evaluate_attack(image_tensor, adversarial_image)
-                
-                # Get adversarial accuracy
-                with torch.no_grad():
-                    adv_outputs = model(adversarial_image.to(device))
-                    adversarial_accuracy = F.softmax(adv_outputs.logits, dim=1).max().item() * 100
-                
-                # Track results
-                if eval_results['success']:
-                    total_success += 1
-                total_original_acc += original_accuracy
-                total_adv_acc += adversarial_accuracy
-                
-                image_results.append({
-                    'image_name': os.path.basename(image_path),
-                    'success': eval_results['success'],
-                    'original_pred': eval_results['original_pred'],
-                    'original_label': resolve_prediction_label(label_map, eval_results['original_pred']),
-                    'adversarial_pred': eval_results['adversarial_pred'],
-                    'adversarial_label': resolve_prediction_label(label_map, eval_results['adversarial_pred']),
-                    'original_confidence': eval_results['original_confidence'] * 100,
-                    'adversarial_confidence': eval_results['adversarial_confidence'] * 100
-                })
-                
-                print(f"   ✅ Success: {eval_results['success']}")
-                print(f"   Original: class {eval_results['original_pred']} ({eval_results['original_confidence']*100:.2f}%)")
-                print(f"   Adversarial: class {eval_results['adversarial_pred']} ({eval_results['adversarial_confidence']*100:.2f}%)")
-                
-            except Exception as e:
-                print(f"   ❌ Error processing image: {str(e)}")
-                continue
-        
-        execution_time = time.time() - start_time
-        
-        # Calculate aggregate metrics
-        num_images = len(image_results)
-        if num_images == 0:
-            return jsonify({'error': 'No images were successfully processed'}), 500
-        
-        success_rate = (total_success / num_images) * 100
-        avg_original_acc = total_original_acc / num_images
-        avg_adv_acc = total_adv_acc / num_images
-        
-        attack_name = attack_type.upper()
-        
-        print(f"\n" + "=" * 60)
-        print(f"✅ Attack completed in {execution_time:.2f}s")
-        print(f"   Images processed: {num_images}")
-        print(f"   Success rate: {success_rate:.1f}%")
-        print(f"   Avg original accuracy: {avg_original_acc:.2f}%")
-        print(f"   Avg adversarial accuracy: {avg_adv_acc:.2f}%")
-        print("=" * 60)
-        print()
-        
-        # Prepare response
-        response = {
-            'attack_type': attack_name,
-            'success_rate': success_rate,
-            'original_accuracy': avg_original_acc,
-            'adversarial_accuracy': avg_adv_acc,
-            'execution_time': execution_time,
-            'num_images': num_images,
-            'image_results': image_results,
-            'details': f"Successfully executed {attack_name} attack on model {model_id} using {num_images} test images. "
-                      f"Attack success rate: {success_rate:.1f}%. "
-                      f"Average original accuracy: {avg_original_acc:.2f}%, "
-                      f"Average adversarial accuracy: {avg_adv_acc:.2f}%. "
-                      f"The attack successfully fooled the model in {total_success} out of {num_images} cases."
-        }
+                    print(f"❌ Error streaming assessment: {str(payload)}")
+                    import traceback
+                    traceback.print_exception(type(payload), payload, payload.__traceback__)
+                    yield format_sse('error', {'error': str(payload), 'status_code': 500})
+        finally:
+            # Closed early (client disconnected): stop the attack at its next checkpoint
+            if worker.is_alive():
+                print(f"🛑 Client disconnected, cancelling assessment {assessment_id}")
+                control.cancel()
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
 
-        persist_history_record(
-            getattr(request, 'clerk_claims', None),
-            model_id,
-            attack_name,
-            response
-        )
+@app.route('/api/threat-assessment/compare', methods=['POST'])
+@require_clerk_auth
+def compare_models():
+    """Attack several models with the same images and return a side-by-side table"""
+    try:
+        params = parse_comparison_request(request.get_json())
+        # Models run one at a time, so the largest one bounds the comparison's memory
+        estimated_bytes = max(estimate_assessment_bytes(params, model['model_id'], model['model_source']) for model in params['models'])
+        with ADMISSION_CONTROLLER.admit(estimated_bytes):
+            response = run_model_comparison(params)
+        
+        clerk_claims = getattr(request, 'clerk_claims', None)
+        for model_result in response['models']:
+            if 'attacks' in model_result:
+                persist_assessment_history(clerk_claims, model_result['model_id'], model_result)
         
         return jsonify(response)
     
+    except AssessmentError as e:
+        return jsonify(e.payload), e.status_code, e.headers
     except Exception as e:
-        print(f"❌ Error: {str(e)}")
+        print(f"❌ Error comparing models: {str(e)}")
         import traceback
         traceback.print_exc()
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/threat-assessment/jobs', methods=['POST'])
+@require_clerk_auth
+def create_threat_assessment_job():
+    """Queue a threat assessment and return its job id immediately"""
+    try:
+        params = parse_assessment_request(request.get_json())
+        job = ASSESSMENT_JOBS.submit(params, getattr(request, 'clerk_claims', None))
+        print(f"📥 Queued assessment job {job['id']} ({job['attack_type']} on {job['model_id']})")
+        
+        return jsonify({
+            'success': True,
+            'job_id': job['id'],
+            'status': job['status'],
+            'status_url': f"/api/threat-assessment/jobs/{job['id']}"
+        }), 202
+    
+    except AssessmentError as e:
+        return jsonify(e.payload), e.status_code, e.headers
+    except Exception as e:
+        print(f"❌ Error queueing assessment: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/threat-assessment/<assessment_id>/cancel', methods=['POST'])
+@require_clerk_auth
+def cancel_threat_assessment(assessment_id):
+    """Cancel a running assessment or queued job by its assessment id (or job id)"""
+    user_id = (getattr(request, 'clerk_claims', {}) or {}).get('sub')
+    if ASSESSMENT_JOBS.cancel_queued(assessment_id, user_id):
+        return jsonify({'success': True, 'assessment_id': assessment_id, 'status': 'cancelled'})
+    if RUNNING_ASSESSMENTS.cancel(assessment_id, user_id):
+        print(f"🛑 Cancelling assessment {assessment_id}")
+        return jsonify({'success': True, 'assessment_id': assessment_id, 'status': 'cancelling'}), 202
+    # Jobs queued or running in another server worker
+    if ASSESSMENT_JOBS.cancel_elsewhere(assessment_id, user_id):
+        print(f"🛑 Requested cancellation of assessment job {assessment_id}")
+        return jsonify({'success': True, 'assessment_id': assessment_id, 'status': 'cancelling'}), 202
+    return jsonify({'error': 'Assessment not found', 'message': 'No running assessment with this id.'}), 404
+
+@app.route('/api/threat-assessment/jobs/<job_id>', methods=['GET'])
+@require_clerk_auth
+def get_threat_assessment_job(job_id):
+    """Get status, per-image progress and (when finished) results of an assessment job"""
+    try:
+        job = get_user_job(job_id)
+        if job is None:
+            return jsonify({'error': 'Job not found'}), 404
+        
+        job.pop('user_id', None)
+        return jsonify({'success': True, 'job': job})
+    
+    except Exception as e:
+        print(f"❌ Error getting assessment job: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
-    ensure_ml_dependencies()
+    # The default readiness check never imports the ML stack; mode=full loads it to report CUDA
+    mode = request.args.get('mode', 'ready')
+    if mode not in ('ready', 'full'):
+        return jsonify({'error': 'Invalid mode', 'message': 'mode must be "ready" or "full"'}), 400
+    if mode == 'full':
+        ensure_inference_dependencies()
     return jsonify({
         'status': 'healthy',
-        'device': str(device),
-        'cuda_available': torch.cuda.is_available()
+        'mode': mode,
+        'device': str(device) if device is not None else None,
+        'cuda_available': torch.cuda.is_available() if device is not None else None,
+        'dependencies': dependency_status(),
+        'model_cache': MODEL_CACHE.stats(),
+        'result_cache': RESULT_CACHE.stats(),
+        'in_flight_assessments': IN_FLIGHT_ASSESSMENTS.stats(),
+        'running_assessments': RUNNING_ASSESSMENTS.stats(),
+        'admission': ADMISSION_CONTROLLER.stats(),
+        'auth': {
+            'token_cache': VERIFIED_TOKENS.stats(),
+            'jwks': CLERK_KEY_SET.stats()
+        }
     })
 
 def generate_report_pdf(results, model_id):
     """Generate a comprehensive PDF report with charts and graphs"""
-    ensure_ml_dependencies()
+    ensure_plotting_dependencies()
     
     # Set style
     sns.set_style("whitegrid")
@@ -1055,6 +3773,39 @@ def generate_report_pdf(results, model_id):
         pdf.savefig(fig, bbox_inches='tight')
         plt.close()
 
+        # Robustness curve page for epsilon sweeps
+        robustness_curve = results.get('robustness_curve') or {}
+        if robustness_curve:
+            fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(11, 8.5))
+            add_page_header(fig, 'Robustness Curve', 'Attack strength (epsilon) against model behaviour')
+            curve_colors = {'FGSM': '#dc2626', 'PGD': '#7c3aed'}
+            for attack_name, points in robustness_curve.items():
+                curve_epsilons = [point['epsilon'] for point in points]
+                color = curve_colors.get(attack_name, '#0f172a')
+                ax1.plot(curve_epsilons, [point['success_rate'] for point in points],
+                         marker='o', linewidth=2, color=color, label=attack_name)
+                ax1.fill_between(curve_epsilons,
+                                 [point['success_rate_interval']['lower'] for point in points],
+                                 [point['success_rate_interval']['upper'] for point in points],
+                                 color=color, alpha=0.12)
+                ax2.plot(curve_epsilons, [point['adversarial_accuracy'] for point in points],
+                         marker='o', linewidth=2, color=color, label=attack_name)
+            
+            ax1.set_title('Attack Success Rate', fontsize=12, fontweight='bold', pad=10)
+            ax1.set_ylabel('Success Rate (%)', fontsize=11, fontweight='bold')
+            ax2.set_title('Adversarial Confidence', fontsize=12, fontweight='bold', pad=10)
+            ax2.set_ylabel('Confidence (%)', fontsize=11, fontweight='bold')
+            for ax in (ax1, ax2):
+                ax.set_xlabel('Epsilon', fontsize=11, fontweight='bold')
+                ax.set_ylim(0, 100)
+                ax.grid(alpha=0.3)
+                ax.legend(loc='best', fontsize=9)
+            
+            plt.tight_layout(rect=[0, 0.05, 1, 0.88])
+            add_footer(fig)
+            pdf.savefig(fig, bbox_inches='tight')
+            plt.close()
+
         # Pages 3+: Detailed per-image evidence
         if image_results:
             images_per_page = 4
@@ -1185,6 +3936,17 @@ def generate_report():
         results = data.get('results')
         model_id = data.get('model_id', 'Unknown Model')
         
+        # Reports can be built from a finished assessment job without resending results
+        job_id = data.get('job_id')
+        if job_id and not results:
+            job = get_user_job(job_id)
+            if job is None:
+                return jsonify({'error': 'Job not found'}), 404
+            if job['status'] != 'completed':
+                return jsonify({'error': 'Job not completed', 'status': job['status']}), 409
+            results = job['result']
+            model_id = data.get('model_id', job['model_id'])
+        
         if not results:
             return jsonify({'error': 'Missing results data'}), 400
         
@@ -1315,22 +4077,26 @@ def upload_model():
         file.save(filepath)
         print(f"✅ Model saved to: {filepath}")
         
-        # Verify the model can be loaded
+        # Verify the model can be loaded (admitted like an assessment, by its weight size)
         file_ext = filename.rsplit('.', 1)[1].lower()
         try:
-            if file_ext in ['pt', 'pth']:
-                model = load_custom_pytorch_model(filepath, num_classes, input_size)
-            elif file_ext in ['h5', 'keras']:
-                model = load_custom_keras_model(filepath)
-            else:
-                raise Exception("Unsupported file format")
-            
-            print(f"✅ Model loaded and verified successfully")
-            
-            # Clean up loaded model from memory
-            del model
-            torch.cuda.empty_cache() if torch.cuda.is_available() else None
+            with ADMISSION_CONTROLLER.admit(os.path.getsize(filepath)):
+                if file_ext in ['pt', 'pth']:
+                    model = load_custom_pytorch_model(filepath, num_classes, input_size)
+                elif file_ext in ['h5', 'keras']:
+                    model = load_custom_keras_model(filepath)
+                else:
+                    raise Exception("Unsupported file format")
+                
+                print(f"✅ Model loaded and verified successfully")
+                
+                # Clean up loaded model from memory
+                del model
+                torch.cuda.empty_cache() if torch.cuda.is_available() else None
             
+        except AssessmentError as e:
+            os.remove(filepath)
+            return jsonify(e.payload), e.status_code, e.headers
         except Exception as e:
             # If model can't be loaded, delete the file
             os.remove(filepath)
@@ -1341,9 +4107,8 @@ def upload_model():
             }), 400
         
         # Save metadata
-        metadata = load_models_metadata()
         model_id = unique_filename
-        metadata[model_id] = {
+        model_info = MODEL_REGISTRY.put(model_id, {
             'name': model_name,
             'description': model_description,
             'filename': unique_filename,
@@ -1353,14 +4118,14 @@ def upload_model():
             'input_size': input_size,
             'upload_date': datetime.now().isoformat(),
             'file_size': os.path.getsize(filepath)
-        }
-        save_models_metadata(metadata)
+        })
+        MODEL_CACHE.invalidate('custom', model_id)
         
         return jsonify({
             'success': True,
             'message': 'Model uploaded successfully',
             'model_id': model_id,
-            'model': metadata[model_id]
+            'model': model_info
         })
     
     except Exception as e:
@@ -1374,7 +4139,7 @@ def upload_model():
 def list_models():
     """Get list of all uploaded custom models"""
     try:
-        metadata = load_models_metadata()
+        metadata = MODEL_REGISTRY.all()
         
         # Convert to list and add additional info
         models = []
@@ -1396,6 +4161,90 @@ def list_models():
         print(f"❌ Error listing models: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+def parse_history_filters(args):
+    """Read history filters from query parameters. Dates are inclusive YYYY-MM-DD days."""
+    filters = {
+        'model_id': args.get('model_id'),
+        'attack_type': (args.get('attack_type') or '').upper() or None,
+        'severity': (args.get('severity') or '').lower() or None
+    }
+    if filters['severity'] and filters['severity'] not in ('low', 'medium', 'high'):
+        raise AssessmentError({'error': 'Invalid severity', 'message': 'severity must be low, medium or high'})
+    
+    for key in ('from', 'to'):
+        value = args.get(key)
+        if not value:
+            continue
+        try:
+            day = datetime.strptime(value[:10], '%Y-%m-%d')
+        except ValueError:
+            raise AssessmentError({'error': f'Invalid {key} date', 'message': 'Dates must be formatted as YYYY-MM-DD'})
+        # "to" is inclusive, so the bound is the start of the following day
+        filters[key] = (day + timedelta(days=1 if key == 'to' else 0)).strftime('%Y-%m-%d')
+    return filters
+
+def encode_history_cursor(cursor):
+    return base64.urlsafe_b64encode(json.dumps(list(cursor)).encode()).decode() if cursor else None
+
+def decode_history_cursor(value):
+    if not value:
+        return None
+    try:
+        timestamp, record_id = json.loads(base64.urlsafe_b64decode(value.encode()))
+        return str(timestamp), str(record_id)
+    except Exception:
+        raise AssessmentError({'error': 'Invalid cursor'})
+
+@app.route('/api/history-records', methods=['GET'])
+@require_clerk_auth
+def query_history_records():
+    """Page through the authenticated user's history records with optional filters."""
+    try:
+        user_id = (getattr(request, 'clerk_claims', {}) or {}).get('sub')
+        limit = request.args.get('limit', default=20, type=int)
+        limit = max(1, min(limit or 20, 100))
+        filters = parse_history_filters(request.args)
+        cursor = decode_history_cursor(request.args.get('cursor'))
+        
+        records, next_cursor = HISTORY_STORE.query(user_id, filters, limit, cursor)
+        
+        return jsonify({
+            'success': True,
+            'history_records': records,
+            'count': len(records),
+            'next_cursor': encode_history_cursor(next_cursor)
+        })
+    except AssessmentError as e:
+        return jsonify(e.payload), e.status_code, e.headers
+    except Exception as e:
+        print(f"❌ Error querying history records: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/history-records/aggregates', methods=['GET'])
+@require_clerk_auth
+def history_record_aggregates():
+    """Mean success rate and accuracies per day, model and attack type for the authenticated user."""
+    try:
+        user_id = (getattr(request, 'clerk_claims', {}) or {}).get('sub')
+        # Rollups are keyed by day, model and attack type only
+        if request.args.get('severity'):
+            return jsonify({
+                'error': 'Unsupported filter',
+                'message': 'severity cannot be used with aggregates; filter by model_id, attack_type, from and to.'
+            }), 400
+        aggregates = HISTORY_STORE.daily_aggregates(user_id, parse_history_filters(request.args))
+        
+        return jsonify({
+            'success': True,
+            'aggregates': aggregates,
+            'count': len(aggregates)
+        })
+    except AssessmentError as e:
+        return jsonify(e.payload), e.status_code, e.headers
+    except Exception as e:
+        print(f"❌ Error aggregating history records: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/history-records/recent', methods=['GET'])
 @require_clerk_auth
 def list_recent_history_records():
@@ -1406,14 +4255,12 @@ def list_recent_history_records():
         limit = request.args.get('limit', default=3, type=int)
         limit = max(1, min(limit or 3, 20))
 
-        records = load_history_records()
-        user_records = [record for record in records if record.get('user_id') == user_id]
-        user_records.sort(key=lambda record: record.get('timestamp', ''), reverse=True)
+        user_records = HISTORY_STORE.recent(user_id, limit)
 
         return jsonify({
             'success': True,
-            'history_records': user_records[:limit],
-            'count': len(user_records[:limit])
+            'history_records': user_records,
+            'count': len(user_records)
         })
     except Exception as e:
         print(f"❌ Error listing history records: {str(e)}")
@@ -1424,20 +4271,20 @@ def list_recent_history_records():
 def delete_model(model_id):
     """Delete a custom model"""
     try:
-        metadata = load_models_metadata()
+        model_info = MODEL_REGISTRY.get(model_id)
         
-        if model_id not in metadata:
+        if model_info is None:
             return jsonify({'error': 'Model not found'}), 404
         
         # Delete the file
-        filepath = os.path.join(MODELS_FOLDER, metadata[model_id]['filename'])
+        filepath = os.path.join(MODELS_FOLDER, model_info['filename'])
         if os.path.exists(filepath):
             os.remove(filepath)
             print(f"🗑️  Deleted model file: {filepath}")
         
         # Remove from metadata
-        del metadata[model_id]
-        save_models_metadata(metadata)
+        MODEL_REGISTRY.remove(model_id)
+        MODEL_CACHE.invalidate('custom', model_id)
         
         return jsonify({
             'success': True,
@@ -1453,12 +4300,11 @@ def delete_model(model_id):
 def get_model_info(model_id):
     """Get information about a specific custom model"""
     try:
-        metadata = load_models_metadata()
+        info = MODEL_REGISTRY.get(model_id)
         
-        if model_id not in metadata:
+        if info is None:
             return jsonify({'error': 'Model not found'}), 404
         
-        info = metadata[model_id]
         filepath = os.path.join(MODELS_FOLDER, info['filename'])
         
         if not os.path.exists(filepath):
@@ -1476,9 +4322,20 @@ def get_model_info(model_id):
         print(f"❌ Error getting model info: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+# Reported at import time rather than under __main__ so gunicorn workers (which import
+# app:app) print it and honour PRELOAD_DEPENDENCIES as well
+print(f"⏱️  App module imported in {time.perf_counter() - APP_IMPORT_STARTED:.2f}s")
+for subsystem in PRELOAD_DEPENDENCIES:
+    if subsystem not in DEPENDENCY_LOADERS:
+        print(f"⚠️  Unknown PRELOAD_DEPENDENCIES entry: {subsystem}")
+        continue
+    DEPENDENCY_LOADERS[subsystem]()
+
 if __name__ == '__main__':
-    ensure_ml_dependencies()
     print(f"Starting ThreatSentry Backend")
-    print(f"Device: {device}")
-    print(f"CUDA Available: {torch.cuda.is_available()}")
+    if device is not None:
+        print(f"Device: {device}")
+        print(f"CUDA Available: {torch.cuda.is_available()}")
+    else:
+        print("Device: selected when the first model is loaded")
     app.run(host='0.0.0.0', port=int(os.environ.get('PORT', 5000)), debug=True)
@@ -0,0 +1,106 @@
+"""
+Tests for result caching and coalescing of identical threat assessments
+Run with: python -m pytest backend/test_assessment_coalescing.py (or python backend/test_assessment_coalescing.py)
+"""
+
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import torch
+import torch.nn as nn
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import app as backend
+
+
+class TinyModel(nn.Module):
+    def __init__(self, num_classes=10):
+        super(TinyModel, self).__init__()
+        self.conv = nn.Conv2d(3, 8, kernel_size=5, stride=4)
+        self.fc = nn.Linear(8, num_classes)
+
+    def forward(self, x):
+        return self.fc(torch.relu(self.conv(x)).mean((2, 3)))
+
+
+PATCHED_ATTRIBUTES = [
+    (backend, 'MODELS_FOLDER'), (backend, 'verify_clerk_jwt'), (backend, '_load_assessment_model'),
+    (backend.MODEL_REGISTRY, 'path'), (backend.RESULT_CACHE, 'folder'), (backend.ATTACK_IMAGE_CACHE, 'folder'),
+    (backend.HISTORY_STORE, 'db_path'), (backend.HISTORY_STORE, 'legacy_json_path'),
+]
+
+
+def use_temporary_storage(folder):
+    """Point every on-disk store of the backend at a temporary folder with one tiny model."""
+    backend.MODELS_FOLDER = folder
+    backend.MODEL_REGISTRY.path = os.path.join(folder, 'models_metadata.json')
+    backend.RESULT_CACHE.folder = os.path.join(folder, 'result_cache')
+    backend.ATTACK_IMAGE_CACHE.folder = os.path.join(folder, 'image_cache')
+    backend.HISTORY_STORE.db_path = os.path.join(folder, 'history.db')
+    backend.HISTORY_STORE.legacy_json_path = os.path.join(folder, 'history_records.json')
+    backend.verify_clerk_jwt = lambda token: {'sub': 'user_test'}
+
+    torch.save(TinyModel(), os.path.join(folder, 'tiny.pt'))
+    backend.MODEL_REGISTRY.put('tiny.pt', {
+        'name': 'tiny', 'filename': 'tiny.pt', 'file_type': 'pt', 'num_classes': 10, 'input_size': 64
+    })
+
+
+def post_assessment(client, body):
+    response = client.post('/api/threat-assessment', json=body, headers={'Authorization': 'Bearer test'})
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()
+
+
+def test_seedless_identical_requests_coalesce_and_hit_the_cache():
+    original_loader = backend._load_assessment_model
+    loads = []
+
+    def slow_loader(model_id, model_source):
+        # Keep the leading request in flight long enough for the others to attach
+        loads.append(model_id)
+        time.sleep(1)
+        return original_loader(model_id, model_source)
+
+    originals = [(owner, name, getattr(owner, name)) for owner, name in PATCHED_ATTRIBUTES]
+    with tempfile.TemporaryDirectory() as folder:
+        use_temporary_storage(folder)
+        backend._load_assessment_model = slow_loader
+        try:
+            client = backend.app.test_client()
+            # No seed, as the dashboard sends it
+            body = {'model_id': 'tiny.pt', 'model_source': 'custom', 'attack_type': 'fgsm', 'num_images': 3}
+
+            responses = []
+            barrier = threading.Barrier(3)
+
+            def run():
+                barrier.wait()
+                responses.append(post_assessment(client, body))
+
+            threads = [threading.Thread(target=run) for _ in range(3)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join(60)
+
+            assert len(responses) == 3
+            assert sorted(response['coalesced'] for response in responses) == [False, True, True]
+            assert len({response['seed'] for response in responses}) == 1
+            assert len({json.dumps(response['image_results'], sort_keys=True) for response in responses}) == 1
+            assert len(loads) == 1
+
+            # A later identical request is served from the result cache
+            assert post_assessment(client, body)['cached'] is True
+        finally:
+            for owner, name, value in originals:
+                setattr(owner, name, value)
+
+
+if __name__ == '__main__':
+    test_seedless_identical_requests_coalesce_and_hit_the_cache()
+    print("✅ test_seedless_identical_requests_coalesce_and_hit_the_cache")
@@ -0,0 +1,116 @@
+"""
+Tests for Clerk session token verification with a local JWKS file
+Run with: python -m pytest backend/test_clerk_auth.py (or python backend/test_clerk_auth.py)
+"""
+
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import jwt
+from jwt.algorithms import RSAAlgorithm
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import app as backend
+
+# Anything slower than this means the request is stuck (the JWKS files are local)
+TIMEOUT_SECONDS = 10
+
+
+def write_jwks(path, private_key, key_id):
+    jwk = json.loads(RSAAlgorithm.to_jwk(private_key.public_key()))
+    jwk.update(kid=key_id, use='sig', alg='RS256')
+    with open(path, 'w') as f:
+        json.dump({'keys': [jwk]}, f)
+
+
+def make_token(private_key, key_id, expires_in=3600):
+    claims = {'sub': 'user_test', 'exp': int(time.time()) + expires_in}
+    return jwt.encode(claims, private_key, algorithm='RS256', headers={'kid': key_id})
+
+
+def run_with_timeout(target):
+    """Run target() in a thread and return (finished, result_or_exception)."""
+    outcome = {}
+
+    def runner():
+        try:
+            outcome['result'] = target()
+        except Exception as e:
+            outcome['result'] = e
+
+    thread = threading.Thread(target=runner, daemon=True)
+    thread.start()
+    thread.join(TIMEOUT_SECONDS)
+    return not thread.is_alive(), outcome.get('result')
+
+
+def make_key_set(folder, private_key, key_id='key_1'):
+    jwks_path = os.path.join(folder, 'jwks.json')
+    write_jwks(jwks_path, private_key, key_id)
+    key_set = backend.ClerkKeySet(None, jwks_path, refresh_seconds=600, min_refetch_seconds=0)
+    key_set.prefetch()
+    return key_set, jwks_path
+
+
+def test_unknown_key_id_is_rejected_without_hanging():
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    with tempfile.TemporaryDirectory() as folder:
+        key_set, _ = make_key_set(folder, private_key)
+
+        finished, result = run_with_timeout(lambda: key_set.get_signing_key('unknown_key'))
+        assert finished, "get_signing_key hung on an unknown key id"
+        assert isinstance(result, Exception)
+        assert key_set.stats()['fetches'] == 2
+
+        # The fetch lock must still be usable afterwards
+        finished, result = run_with_timeout(key_set.refresh)
+        assert finished and result is True
+
+
+def test_rotated_key_is_picked_up_by_refetch():
+    old_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    new_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    with tempfile.TemporaryDirectory() as folder:
+        key_set, jwks_path = make_key_set(folder, old_key)
+        write_jwks(jwks_path, new_key, 'key_2')
+
+        finished, result = run_with_timeout(lambda: key_set.get_signing_key('key_2'))
+        assert finished, "get_signing_key hung while refetching rotated keys"
+        assert not isinstance(result, Exception), result
+
+
+def test_request_with_unknown_key_id_returns_401():
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    with tempfile.TemporaryDirectory() as folder:
+        key_set, _ = make_key_set(folder, private_key)
+        original_key_set = backend.CLERK_KEY_SET
+        backend.CLERK_KEY_SET = key_set
+        try:
+            client = backend.app.test_client()
+            token = make_token(private_key, 'made_up_key')
+            finished, response = run_with_timeout(
+                lambda: client.get('/api/models/list', headers={'Authorization': f'Bearer {token}'}))
+            assert finished, "/api/models/list hung on a token with an unknown key id"
+            assert response.status_code == 401
+
+            # A valid token is verified once and then served from the claims cache
+            token = make_token(private_key, 'key_1')
+            hits = backend.VERIFIED_TOKENS.hits
+            assert backend.verify_clerk_jwt(token)['sub'] == 'user_test'
+            assert backend.verify_clerk_jwt(token)['sub'] == 'user_test'
+            assert backend.VERIFIED_TOKENS.hits == hits + 1
+        finally:
+            backend.CLERK_KEY_SET = original_key_set
+
+
+if __name__ == '__main__':
+    for test in (test_unknown_key_id_is_rejected_without_hanging,
+                 test_rotated_key_is_picked_up_by_refetch,
+                 test_request_with_unknown_key_id_returns_401):
+        test()
+        print(f"✅ {test.__name__}")
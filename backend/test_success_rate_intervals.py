@@ -0,0 +1,65 @@
+"""
+Tests for the success-rate confidence intervals and the adaptive stopping rule
+Run with: python -m pytest backend/test_success_rate_intervals.py (or python backend/test_success_rate_intervals.py)
+"""
+
+import math
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import app as backend
+
+
+def assert_interval(interval, lower, upper, tolerance=1e-4):
+    assert math.isclose(interval[0], lower, abs_tol=tolerance), interval
+    assert math.isclose(interval[1], upper, abs_tol=tolerance), interval
+
+
+def test_wilson_interval_at_95_percent():
+    assert_interval(backend.wilson_interval(5, 10), 0.2366, 0.7634)
+    assert_interval(backend.wilson_interval(0, 10), 0.0, 0.2775)
+    assert_interval(backend.wilson_interval(10, 10), 0.7225, 1.0)
+
+
+def test_clopper_pearson_interval_at_95_percent():
+    assert_interval(backend.clopper_pearson_interval(5, 10), 0.1871, 0.8129)
+    # With no successes (or no failures) one bound is exact: (alpha / 2) ** (1 / n)
+    assert_interval(backend.clopper_pearson_interval(0, 10), 0.0, 1 - 0.025 ** (1 / 10))
+    assert_interval(backend.clopper_pearson_interval(10, 10), 0.025 ** (1 / 10), 1.0)
+
+
+def test_clopper_pearson_is_wider_than_wilson():
+    for successes in (0, 3, 5, 10):
+        wilson = backend.wilson_interval(successes, 10)
+        exact = backend.clopper_pearson_interval(successes, 10)
+        assert exact[0] <= wilson[0] and exact[1] >= wilson[1]
+
+
+def test_success_rate_interval_is_in_percent():
+    interval = backend.success_rate_interval(5, 10, 0.95, 'clopper-pearson')
+    assert math.isclose(interval['lower'], 18.71, abs_tol=0.01)
+    assert math.isclose(interval['upper'], 81.29, abs_tol=0.01)
+    assert math.isclose(interval['width'], interval['upper'] - interval['lower'])
+    assert interval['confidence'] == 0.95 and interval['method'] == 'clopper-pearson'
+
+
+def test_adaptive_stop_reason():
+    # Narrow enough, wherever it lies
+    assert backend.adaptive_stop_reason({'lower': 45.0, 'upper': 55.0, 'width': 10.0}, 10.0) == 'interval_width'
+    # Wide, but both bounds fall in the high severity bucket
+    assert backend.adaptive_stop_reason({'lower': 75.0, 'upper': 95.0, 'width': 20.0}, 10.0) == 'severity_determined'
+    # Wide and straddling the medium/high boundary at 70%
+    assert backend.adaptive_stop_reason({'lower': 60.0, 'upper': 80.0, 'width': 20.0}, 10.0) is None
+    # 5/10 images cannot decide anything yet at the default 10-point width
+    assert backend.adaptive_stop_reason(backend.success_rate_interval(5, 10), 10.0) is None
+
+
+if __name__ == '__main__':
+    for test in (test_wilson_interval_at_95_percent,
+                 test_clopper_pearson_interval_at_95_percent,
+                 test_clopper_pearson_is_wider_than_wilson,
+                 test_success_rate_interval_is_in_percent,
+                 test_adaptive_stop_reason):
+        test()
+        print(f"✅ {test.__name__}")